@@ -0,0 +1,220 @@
+# gnome code assistance c backend
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from gi.repository import GLib
+
+import hashlib, threading, json, os, ctypes
+
+from gnome.codeassistance import types
+
+import clang.cindex as cindex
+
+# Bump whenever the format of the cache entries changes
+FORMAT_VERSION = 1
+
+def _str(s):
+    if isinstance(s, bytes):
+        return s.decode('utf-8')
+
+    return s
+
+def _bytes(s):
+    # The file name arguments of TranslationUnit.save and from_ast_file are
+    # passed to libclang as is
+    if isinstance(s, str):
+        return s.encode('utf-8')
+
+    return s
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime
+    except OSError:
+        return None
+
+class ASTCache:
+    """A persistent cache of translation units.
+
+    Translation units are saved in $XDG_CACHE_HOME/gnome-code-assistance/c-ast
+    as serialized ASTs, so that a restarted daemon does not have to parse
+    every source file from scratch. Entries are addressed by the source file,
+    the compiler flags, the parse options and the libclang library. Each
+    entry records the modification times of the source file and all of its
+    includes, and is only loaded while none of them have changed. Since a
+    serialized AST does not keep the diagnostics of the parse, these are
+    stored along with it.
+
+    The total size of the cache is bounded by size (in bytes), the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, size):
+        self.path = os.path.join(GLib.get_user_cache_dir(), 'gnome-code-assistance', 'c-ast')
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._total = None
+
+    def key(self, path, args, options):
+        """compute the cache key of a translation unit."""
+        h = hashlib.sha1()
+
+        library = os.path.realpath(cindex.conf.get_filename())
+
+        for v in (FORMAT_VERSION, library, _mtime(library), path, repr([_str(a) for a in args]), options):
+            h.update(str(v).encode('utf-8'))
+            h.update(b'\0')
+
+        return h.hexdigest()
+
+    def _filenames(self, key):
+        base = os.path.join(self.path, key)
+        return base + '.ast', base + '.json'
+
+    def load(self, key, index):
+        """load a translation unit.
+
+        Returns a (tu, diagnostics) tuple, where diagnostics maps real file
+        paths to lists of types.Diagnostic, or None if there is no up to date
+        entry for key.
+        """
+        astname, metaname = self._filenames(key)
+
+        try:
+            with open(metaname) as f:
+                meta = json.load(f)
+
+            for filename, mtime in meta['files']:
+                if _mtime(filename) != mtime:
+                    return None
+
+            tu = cindex.TranslationUnit.from_ast_file(_bytes(astname), index)
+
+            os.utime(astname, None)
+            os.utime(metaname, None)
+        except (IOError, OSError, ValueError, KeyError, TypeError, ctypes.ArgumentError, cindex.TranslationUnitLoadError):
+            return None
+
+        diagnostics = {f: [types.Diagnostic.from_tuple(tp) for tp in tps]
+                       for f, tps in meta['diagnostics'].items()}
+
+        return tu, diagnostics
+
+    def store(self, key, tu, path, diagnostics, parsed):
+        """save a translation unit.
+
+        tu is the translation unit of the source file at path, parsed from the
+        on disk contents at time parsed, and diagnostics its diagnostics by
+        real file path. Translation units of which any of the files have
+        been modified since they were parsed are not saved.
+        """
+        files = [path] + [_str(i.include.name) for i in tu.get_includes()]
+        mtimes = []
+
+        for filename in files:
+            mtime = _mtime(filename)
+
+            if mtime is None or mtime >= parsed:
+                return
+
+            mtimes.append((filename, mtime))
+
+        astname, metaname = self._filenames(key)
+        suffix = '.{0}.tmp'.format(threading.current_thread().ident)
+
+        data = json.dumps({'files': mtimes,
+                           'diagnostics': {f: [d.to_tuple() for d in diags]
+                                           for f, diags in diagnostics.items()}})
+
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+
+            tu.save(_bytes(astname + suffix))
+
+            with open(metaname + suffix, 'w') as f:
+                f.write(data)
+
+            os.rename(astname + suffix, astname)
+            os.rename(metaname + suffix, metaname)
+
+            size = os.stat(astname).st_size + len(data)
+        except (IOError, OSError, ctypes.ArgumentError, cindex.TranslationUnitSaveError):
+            for filename in (astname + suffix, metaname + suffix):
+                try:
+                    os.unlink(filename)
+                except OSError:
+                    pass
+
+            return
+
+        with self._lock:
+            if self._total is None:
+                self._total = sum(e[1] for e in self._entries())
+            else:
+                self._total += size
+
+            if self._total > self.size:
+                self._evict()
+
+    def _entries(self):
+        ret = []
+
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return ret
+
+        for name in names:
+            if not name.endswith('.ast'):
+                continue
+
+            astname = os.path.join(self.path, name)
+            metaname = astname[:-len('.ast')] + '.json'
+
+            try:
+                st = os.stat(astname)
+                size = st.st_size + os.stat(metaname).st_size
+            except OSError:
+                continue
+
+            ret.append((st.st_mtime, size, astname, metaname))
+
+        return ret
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort()
+
+        self._total = sum(e[1] for e in entries)
+
+        # Evict down to 90% so that we do not scan on every store
+        target = self.size * 0.9
+
+        for mtime, size, astname, metaname in entries:
+            if self._total <= target:
+                break
+
+            try:
+                os.unlink(metaname)
+                os.unlink(astname)
+            except OSError:
+                continue
+
+            self._total -= size
+
+# ex:ts=4:et:
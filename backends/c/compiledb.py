@@ -0,0 +1,232 @@
+# gnome code assistance c backend
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os, json, shlex
+
+from gnome.codeassistance.c.flags import filter_flags, force_cxx_if_needed
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+class CompilationDatabaseIntegration:
+    """Compile flags from a JSON compilation database.
+
+    The database (compile_commands.json, as generated by cmake, meson,
+    bear and others) is looked up in the directory of a source file and its
+    parents, or in a build subdirectory of those. A database is indexed once
+    and reindexed when it is modified. Files which are not in the database
+    (headers) get the flags of a source file with the same name in the same
+    directory, of any source file in the same directory or, failing that, of
+    a source file with the same name elsewhere.
+    """
+
+    debug = False
+
+    filename = 'compile_commands.json'
+    builddirs = ['', 'build']
+
+    class Database:
+        def __init__(self, path):
+            self.path = path
+            self.mtime = _mtime(path)
+
+            self._commands = {}
+            self._by_dir = {}
+            self._by_dir_stem = {}
+            self._by_stem = {}
+            self._flags = {}
+
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                entries = []
+
+            if not isinstance(entries, list):
+                entries = []
+
+            for entry in entries:
+                try:
+                    self._add(entry)
+                except (KeyError, TypeError, ValueError):
+                    pass
+
+        def _add(self, entry):
+            wd = entry['directory']
+            source = os.path.normpath(os.path.join(wd, entry['file']))
+
+            if 'arguments' in entry:
+                args = list(entry['arguments'])
+            else:
+                args = shlex.split(entry['command'])
+
+            # Keep the first command of sources which are built more than once
+            if source in self._commands:
+                return
+
+            self._commands[source] = (wd, args)
+
+            dirname = os.path.dirname(source)
+            stem = self._stem(source)
+
+            self._by_dir.setdefault(dirname, source)
+            self._by_dir_stem.setdefault((dirname, stem), source)
+            self._by_stem.setdefault(stem, source)
+
+        def _stem(self, path):
+            return os.path.splitext(os.path.basename(path))[0]
+
+        def _source_for(self, path):
+            if path in self._commands:
+                return path
+
+            dirname = os.path.dirname(path)
+            stem = self._stem(path)
+
+            # Prefer sources close to the file, names like util or main are
+            # often used in several directories
+            for index, key in ((self._by_dir_stem, (dirname, stem)),
+                               (self._by_dir, dirname),
+                               (self._by_stem, stem)):
+                try:
+                    return index[key]
+                except KeyError:
+                    pass
+
+            return None
+
+        def flags_for_file(self, path):
+            try:
+                return self._flags[path]
+            except KeyError:
+                pass
+
+            source = self._source_for(path)
+
+            if source is None:
+                flags = None
+            else:
+                wd, args = self._commands[source]
+                flags = filter_flags(wd, args[1:])
+
+                compiler = os.path.basename(args[0]) if len(args) > 0 else ''
+
+                if compiler.endswith('++') or source.endswith(('.cc', '.cpp', '.cxx', '.C')):
+                    flags = force_cxx_if_needed(flags)
+
+            self._flags[path] = flags
+            return flags
+
+    def __init__(self):
+        self._databases = {}
+        self._file_to_database = {}
+
+    def _database_path_for(self, path):
+        parent = os.path.dirname(path)
+
+        while True:
+            for d in self.builddirs:
+                dbpath = os.path.join(parent, d, self.filename)
+
+                if os.path.isfile(dbpath):
+                    return os.path.normpath(dbpath)
+
+            if parent == '/' or parent == '':
+                break
+
+            parent = os.path.dirname(parent)
+
+        return None
+
+    def _database(self, dbpath):
+        try:
+            db = self._databases[dbpath]
+
+            if db.mtime == _mtime(dbpath):
+                return db
+        except KeyError:
+            pass
+
+        if self.debug:
+            print('  Indexing: {0}'.format(dbpath))
+
+        db = CompilationDatabaseIntegration.Database(dbpath)
+        self._databases[dbpath] = db
+
+        return db
+
+    def changed_for_file(self, path):
+        try:
+            dbpath, mtime = self._file_to_database[path]
+        except KeyError:
+            return True
+
+        newpath = self._database_path_for(path)
+
+        if newpath != dbpath:
+            return True
+
+        return not dbpath is None and _mtime(dbpath) != mtime
+
+    def dispose(self, path):
+        try:
+            dbpath, mtime = self._file_to_database.pop(path)
+        except KeyError:
+            return
+
+        if dbpath is None:
+            return
+
+        # Drop the index when none of the files using it are open anymore
+        for p, v in self._file_to_database.items():
+            if v[0] == dbpath:
+                return
+
+        self._databases.pop(dbpath, None)
+
+    def flags_for_file(self, path, cancellable=None):
+        dbpath = self._database_path_for(path)
+
+        if self.debug:
+            print('Scanning for {0}'.format(path))
+            print('  Database: {0}'.format(dbpath))
+
+        if dbpath is None:
+            self._file_to_database[path] = (None, None)
+            return None
+
+        db = self._database(dbpath)
+        self._file_to_database[path] = (dbpath, db.mtime)
+
+        flags = db.flags_for_file(path)
+
+        if self.debug and not flags is None:
+            print('  Flags: [{0}]'.format(', '.join(flags)))
+
+        return flags
+
+if __name__ == '__main__':
+    import sys
+
+    c = CompilationDatabaseIntegration()
+    c.debug = True
+    c.flags_for_file(os.path.abspath(sys.argv[1]))
+
+# ex:ts=4:et:
@@ -0,0 +1,145 @@
+# gnome code assistance c backend
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+
+class Providers:
+    """A chain of compile flags providers.
+
+    A provider implements:
+
+        flags_for_file(path, cancellable): the compile flags of the source
+        file at path, or None if the provider does not know how the file is
+        built.
+
+        changed_for_file(path): whether the flags previously provided (or
+        not provided) for path might have changed.
+
+        dispose(path): forget about path.
+
+    The flags of a file are taken from the first provider which knows how to
+    build it, or are empty if none does.
+    """
+
+    def __init__(self, providers):
+        self.providers = providers
+        self._provided_by = {}
+
+    def flags_for_file(self, path, cancellable=None):
+        for p in self.providers:
+            flags = p.flags_for_file(path, cancellable)
+
+            if not flags is None:
+                self._provided_by[path] = p
+                return flags
+
+        self._provided_by[path] = None
+        return []
+
+    def changed_for_file(self, path):
+        try:
+            provider = self._provided_by[path]
+        except KeyError:
+            return True
+
+        # The flags also change when a preferred provider starts to know
+        # about the file
+        for p in self.providers:
+            if p.changed_for_file(path):
+                return True
+
+            if p is provider:
+                break
+
+        return False
+
+    def dispose(self, path):
+        self._provided_by.pop(path, None)
+
+        for p in self.providers:
+            p.dispose(path)
+
+def force_cxx_if_needed(flags):
+    for f in flags:
+        if f.startswith('-x'):
+            return flags
+
+    flags.append('-xc++')
+    return flags
+
+def filter_flags(wd, flags):
+    """filter the flags relevant to parsing from a compiler command line.
+
+    Relative include paths are resolved against wd, the directory in which
+    the compiler runs.
+    """
+
+    # Keep only interesting flags:
+    # -I: include paths
+    # -D: defines
+    # -W: warnings
+    # -f: compiler flags
+    # -x: language
+    # -std=<std>: standard
+
+    i = 0
+    inexpand = False
+    ret = []
+
+    while i < len(flags):
+        flag = flags[i]
+        i += 1
+
+        if '`' in flag:
+            inexpand = not inexpand
+
+        if inexpand or len(flag) < 2:
+            continue
+
+        if flag[0] != '-':
+            continue
+
+        v = flag[1]
+
+        if v == 'I':
+            if len(flag) > 2:
+                ipath = flag[2:]
+            elif i < len(flags):
+                ipath = flags[i]
+                i += 1
+            else:
+                continue
+
+            if not os.path.isabs(ipath):
+                ipath = os.path.normpath(os.path.join(wd, ipath))
+
+            ret.append('-I')
+            ret.append(ipath)
+        elif v == 'D' or v == 'f' or v == 'W' or v == 'x':
+            # pass defines, compiler flags and warnings
+            ret.append(flag)
+
+            # Also add the argument if its not embedded
+            if (v == 'D' or v == 'x') and len(flag) == 2 and i < len(flags):
+                ret.append(flags[i])
+                i += 1
+        elif flag.startswith('-std='):
+            ret.append(flag)
+
+    return ret
+
+# ex:ts=4:et:
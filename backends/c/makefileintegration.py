@@ -15,12 +15,20 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import os, subprocess, re, shlex
+import os, subprocess, re, shlex, threading
 from gi.repository import Gio
 
+from gnome.codeassistance import worker
+from gnome.codeassistance.c.flags import filter_flags, force_cxx_if_needed
+
 class MakefileIntegration:
     debug = False
 
+    fakecc = '__GCA_C_COMPILE_FLAGS__'
+    fakecxx = '__GCA_CXX_COMPILE_FLAGS__'
+
+    source_extensions = ('.c', '.cc', '.cpp', '.cxx', '.c++', '.C')
+
     class Makefile:
         class Source:
             mtime = 0
@@ -30,6 +38,14 @@ class MakefileIntegration:
             self.path = path
             self._sources = {}
 
+            # The parsed make database, shared by all sources of the Makefile
+            self.database = None
+
+            # The mtime at which the flags of all sources were last scanned
+            self.scanned_mtime = None
+
+            self.lock = threading.RLock()
+
             self._update_mtime()
 
             f = Gio.file_new_for_path(path)
@@ -48,6 +64,20 @@ class MakefileIntegration:
 
         def _on_changed(self, *args):
             self._update_mtime()
+            self.database = None
+
+        def database_up_to_date(self):
+            if self.database is None:
+                return False
+
+            # Without a monitor, changes are only noticed by polling
+            if self._monitor is None:
+                self._update_mtime()
+
+            return self._mtime <= self.database.mtime
+
+        def scanned_up_to_date(self):
+            return not self.scanned_mtime is None and self._mtime <= self.scanned_mtime
 
         def dispose(self):
             if not self._monitor is None:
@@ -64,18 +94,6 @@ class MakefileIntegration:
         def add(self, source, flags):
             self._sources[source] = self.make_source(flags)
 
-        def remove(self, source):
-            try:
-                del self._sources[source]
-
-                if len(self._sources) == 0:
-                    self.dispose()
-                    return True
-            except:
-                pass
-
-            return False
-
         def up_to_date_for(self, source):
             if not source in self._sources:
                 return False
@@ -88,6 +106,75 @@ class MakefileIntegration:
             except KeyError:
                 return []
 
+    class Database:
+        """The target graph of a make database (as printed by make -p)."""
+
+        def __init__(self, outstr, mtime):
+            self.mtime = mtime
+
+            # Map from prerequisite to the targets depending on it, in the
+            # order in which they appear in the database
+            self._dependents = {}
+            self._order = {}
+
+            self.prerequisites = []
+            seen = set()
+
+            reg = re.compile('^([^:\n ]+):(.*)$', re.M)
+
+            for match in reg.finditer(outstr):
+                target = match.group(1)
+
+                if target[0] == '#' or '-am' in target:
+                    continue
+
+                if not target in self._order:
+                    self._order[target] = len(self._order)
+
+                for prereq in match.group(2).split():
+                    if not prereq in seen:
+                        seen.add(prereq)
+                        self.prerequisites.append(prereq)
+
+                    self._add(prereq, target)
+
+                    # Prerequisites are also found by their file name
+                    i = prereq.rfind('/')
+
+                    if i != -1:
+                        self._add(prereq[i + 1:], target)
+
+        def _add(self, prereq, target):
+            try:
+                targets = self._dependents[prereq]
+            except KeyError:
+                self._dependents[prereq] = [target]
+                return
+
+            if targets[-1] != target:
+                targets.append(target)
+
+        def dependents(self, lookfor):
+            """get all targets depending, directly or indirectly, on lookfor."""
+            targets = []
+            found = {}
+
+            while len(lookfor) > 0:
+                level = []
+
+                for name in lookfor:
+                    for target in self._dependents.get(name, []):
+                        if not target in found:
+                            found[target] = True
+                            level.append(target)
+
+                level.sort(key=lambda x: self._order[x])
+
+                targets += level
+                lookfor = level
+
+            return targets
+
     def __init__(self):
         self._cache = {}
         self._file_to_makefile = {}
@@ -116,16 +203,20 @@ class MakefileIntegration:
 
     def dispose(self, path):
         try:
-            makefile = self._file_to_makefile[path]
+            makefile = self._file_to_makefile.pop(path)
+        except KeyError:
+            return
 
-            if makefile.remove(path):
-                del self._cache[makefile.path]
+        # Keep the flags of all sources of the Makefile while any of them is
+        # still open
+        for m in self._file_to_makefile.values():
+            if m is makefile:
+                return
 
-            del self._file_to_makefile[path]
-        except:
-            pass
+        makefile.dispose()
+        self._cache.pop(makefile.path, None)
 
-    def flags_for_file(self, path):
+    def flags_for_file(self, path, cancellable=None):
         path = self._file_as_abs(path)
         makefile = self._makefile_for(path)
 
@@ -134,40 +225,47 @@ class MakefileIntegration:
             print('  Makefile: {0}'.format(makefile))
 
         if makefile is None:
-            return []
+            return None
 
-        try:
-            m = self._cache[makefile]
+        m = self._makefile(makefile)
 
-            if m.up_to_date_for(path):
-                flags = m.flags_for_file(path)
+        # Extract the flags of all sources of the Makefile at once, so that
+        # opening other sources in the same directory does not run make
+        if not m.up_to_date_for(path) and not m.scanned_up_to_date():
+            self._scan_makefile(makefile, cancellable)
 
-                if self.debug:
-                    print('  From cache: {0}'.format(', '.join(flags)))
+        if m.up_to_date_for(path):
+            flags = m.flags_for_file(path)
+            self._file_to_makefile[path] = m
 
-                return flags
-        except KeyError:
-            pass
+            if self.debug:
+                print('  From cache: {0}'.format(', '.join(flags)))
+
+            return flags
 
-        targets = self._targets_from_make(makefile, path)
+        targets = self._targets_from_make(makefile, path, cancellable)
 
         if self.debug:
             print('  Targets: [{0}]'.format(', '.join(targets)))
 
-        flags = self._flags_from_targets(makefile, path, targets)
+        flags = self._flags_from_targets(makefile, path, targets, cancellable)
 
         if self.debug:
             print('  Flags: [{0}]'.format(', '.join(flags)))
 
         return self._update_cache(makefile, path, flags)
 
-    def _update_cache(self, makefile, path, flags):
+    def _makefile(self, makefile):
         try:
-            m = self._cache[makefile]
+            return self._cache[makefile]
         except KeyError:
             m = MakefileIntegration.Makefile(makefile)
             self._cache[makefile] = m
 
+            return m
+
+    def _update_cache(self, makefile, path, flags):
+        m = self._makefile(makefile)
         m.add(path, flags)
         self._file_to_makefile[path] = m
 
@@ -238,6 +336,28 @@ class MakefileIntegration:
 
         return None
 
+    def _run_make(self, args, wd, cancellable):
+        with open(os.devnull, 'w') as stderr:
+            p = subprocess.Popen(args, cwd=wd, stdout=subprocess.PIPE, stderr=stderr)
+
+        if cancellable is None:
+            outstr = p.communicate()[0]
+        else:
+            # Kill make if the parse requesting the flags is cancelled
+            handler = cancellable.connect(p.kill)
+
+            try:
+                outstr = p.communicate()[0]
+            finally:
+                cancellable.disconnect(handler)
+
+            cancellable.raise_if_cancelled()
+
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, args)
+
+        return outstr.decode('utf-8')
+
     def _sort_target(self, target, regs):
         for i, reg in enumerate(regs):
             if reg.match(target):
@@ -245,7 +365,35 @@ class MakefileIntegration:
 
         return len(regs)
 
-    def _targets_from_make(self, makefile, source):
+    def _database(self, makefile, cancellable=None):
+        m = self._makefile(makefile)
+
+        # The database is only scanned once for all sources of the Makefile
+        with m.lock:
+            if m.database_up_to_date():
+                return m.database
+
+            mtime = m._mtime
+            args = ['make', '-p', '-n', '-s', '.']
+
+            try:
+                outstr = self._run_make(args, os.path.dirname(makefile), cancellable)
+            except worker.Cancelled:
+                raise
+            except Exception as e:
+                if self.debug:
+                    print('  Failed to run make: {0}'.format(e))
+
+                return None
+
+            m.database = MakefileIntegration.Database(outstr, mtime)
+
+            if self.debug:
+                print('  Scanned make database')
+
+            return m.database
+
+    def _targets_from_make(self, makefile, source, cancellable=None):
         wd = os.path.dirname(makefile)
 
         lookfor = [
@@ -262,42 +410,12 @@ class MakefileIntegration:
         if self.debug:
             print('  Looking for: [{0}]'.format(', '.join(lookfor)))
 
-        args = ['make', '-p', '-n', '-s', '.']
-
-        try:
-            with open(os.devnull, 'w') as stderr:
-                outstr = subprocess.check_output(args, cwd=wd, stderr=stderr).decode('utf-8')
-        except StandardError as e:
-            if self.debug:
-                print('  Failed to run make: {0}'.format(e))
+        database = self._database(makefile, cancellable)
 
+        if database is None:
             return []
 
-        targets = []
-        found = {}
-
-        while len(lookfor) > 0:
-            # Make a regular expression which will match all printed targets that
-            # depend on the file we are looking for
-            if self.debug:
-                print('  looking for: [{0}]'.format(', '.join(lookfor)))
-
-            relookfor = [re.escape(x) for x in lookfor]
-            reg = re.compile('^([^:\n ]+):.*\\b({0})\\b'.format('|'.join(relookfor)), re.M)
-            lookfor = []
-
-            for match in reg.finditer(outstr):
-                target = match.group(1)
-
-                if target[0] == '#' or '-am' in target:
-                    continue
-
-                if target in found:
-                    continue
-
-                targets.append(target)
-                found[target] = True
-                lookfor.append(target)
+        targets = database.dependents(lookfor)
 
         noext = [re.escape(os.path.splitext(x)[0]) for x in origlookfor]
 
@@ -312,12 +430,12 @@ class MakefileIntegration:
         targets.sort(key=lambda x: self._sort_target(x, targetregs))
         return targets
 
-    def _flags_from_targets(self, makefile, source, targets):
+    def _flags_from_targets(self, makefile, source, targets, cancellable=None):
         if len(targets) == 0:
             return []
 
-        fakecc = '__GCA_C_COMPILE_FLAGS__'
-        fakecxx = '__GCA_CXX_COMPILE_FLAGS__'
+        fakecc = self.fakecc
+        fakecxx = self.fakecxx
 
         wd = os.path.dirname(makefile)
         relsource = os.path.relpath(source, wd)
@@ -337,8 +455,9 @@ class MakefileIntegration:
         args += targets
 
         try:
-            with open(os.devnull, 'w') as stderr:
-                outstr = subprocess.check_output(args, cwd=wd, stderr=stderr).decode('utf-8')
+            outstr = self._run_make(args, wd, cancellable)
+        except worker.Cancelled:
+            raise
         except Exception as e:
             if self.debug:
                 print('  Failed to run make: {0}'.format(e))
@@ -348,77 +467,125 @@ class MakefileIntegration:
         regfind = re.compile('({0}|{1})([^\n]*)$'.format(fakecc, fakecxx), re.M)
 
         for m in regfind.finditer(outstr):
-            flags = self._filter_flags(makefile, shlex.split(m.group(2)))
+            flags = filter_flags(os.path.dirname(makefile), shlex.split(m.group(2)))
 
             if m.group(1) == fakecxx:
-                flags = self._force_cxx_if_needed(flags)
+                flags = force_cxx_if_needed(flags)
 
             return flags
 
         return []
 
-    def _force_cxx_if_needed(self, flags):
-        for f in flags:
-            if f.startswith('-x'):
-                return flags
+    def _scan_makefile(self, makefile, cancellable=None):
+        """extract the flags of all sources of makefile in a single make run.
 
-        flags.append('-xc++')
-        return flags
+        All sources known to the make database are marked as modified (-W)
+        at once and each compile line of the dry run is attributed to the
+        source it compiles.
+        """
+        m = self._makefile(makefile)
 
-    def _filter_flags(self, makefile, flags):
-        # Keep only interesting flags:
-        # -I: include paths
-        # -D: defines
-        # -W: warnings
-        # -f: compiler flags
-        # -x: language
-        # -std=<std>: standard
+        with m.lock:
+            if m.scanned_up_to_date():
+                return
 
-        i = 0
-        inexpand = False
-        ret = []
+            mtime = m._mtime
+            database = self._database(makefile, cancellable)
 
-        wd = os.path.dirname(makefile)
+            if database is None:
+                m.scanned_mtime = mtime
+                return
 
-        while i < len(flags):
-            flag = flags[i]
-            i += 1
+            wd = os.path.dirname(makefile)
+            sources = {}
 
-            if '`' in flag:
-                inexpand = not inexpand
+            for name in database.prerequisites:
+                if '%' in name or not name.endswith(self.source_extensions):
+                    continue
 
-            if inexpand or len(flag) < 2:
-                continue
+                path = os.path.normpath(os.path.join(wd, name))
 
-            if flag[0] != '-':
-                continue
+                if os.path.isfile(path):
+                    sources[name] = path
+
+            objreg = re.compile('^.*\\.(o|lo)$')
+            targets = [t for t in database.dependents(list(sources)) if objreg.match(t)]
+
+            if len(targets) == 0:
+                m.scanned_mtime = mtime
+                return
+
+            args = ['make', '-s', '-i', '-n']
+
+            for name in sources:
+                args += ['-W', name]
 
-            v = flag[1]
+            args += ['V=1', 'CC=' + self.fakecc, 'CXX=' + self.fakecxx]
+            args += targets
 
-            if v == 'I':
-                if len(flag) > 2:
-                    ipath = flag[2:]
-                elif i < len(flags):
-                    ipath = flags[i]
-                    i += 1
+            try:
+                outstr = self._run_make(args, wd, cancellable)
+            except worker.Cancelled:
+                raise
+            except Exception as e:
+                if self.debug:
+                    print('  Failed to run make: {0}'.format(e))
+
+                outstr = ''
+
+            flags = self._flags_by_source(wd, sources, outstr)
+
+            for path in flags:
+                m.add(path, flags[path])
+
+            m.scanned_mtime = mtime
+
+            if self.debug:
+                print('  Scanned flags of {0} sources'.format(len(flags)))
+
+    def _flags_by_source(self, wd, sources, outstr):
+        # Map the names by which a source may appear on a compile line to
+        # its path, names shared by different sources are ambiguous
+        names = {}
+
+        for name, path in sources.items():
+            for n in (name, os.path.basename(name)):
+                if names.get(n, path) != path:
+                    names[n] = None
                 else:
-                    continue
+                    names[n] = path
+
+        regfind = re.compile('({0}|{1})([^\n]*)$'.format(self.fakecc, self.fakecxx), re.M)
+        regtoken = re.compile('[^\\s\'"`;|&()]+')
+
+        ret = {}
+
+        for match in regfind.finditer(outstr):
+            path = None
+
+            # The source is usually the last argument
+            for token in reversed(regtoken.findall(match.group(2))):
+                if token.startswith('./'):
+                    token = token[2:]
+
+                path = names.get(token) or names.get(os.path.basename(token))
+
+                if not path is None:
+                    break
+
+            # The first compile line of a source wins
+            if path is None or path in ret:
+                continue
+
+            try:
+                flags = filter_flags(wd, shlex.split(match.group(2)))
+            except ValueError:
+                continue
+
+            if match.group(1) == self.fakecxx:
+                flags = force_cxx_if_needed(flags)
 
-                if not os.path.isabs(ipath):
-                    ipath = os.path.normpath(os.path.join(wd, ipath))
-
-                ret.append('-I')
-                ret.append(ipath)
-            elif v == 'D' or v == 'f' or v == 'W' or v == 'x':
-                # pass defines, compiler flags and warnings
-                ret.append(flag)
-
-                # Also add the argument if its not embedded
-                if (v == 'D' or v == 'x') and len(flag) == 2 and i < len(flags):
-                    ret.append(flags[i])
-                    i += 1
-            elif flag.startswith('-std='):
-                ret.append(flag)
+            ret[path] = flags
 
         return ret
 
@@ -15,11 +15,11 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-from gnome.codeassistance.c import clangimporter, makefileintegration, config
-from gnome.codeassistance import transport, types
+from gnome.codeassistance.c import clangimporter, makefileintegration, compiledb, flags, config, astcache
+from gnome.codeassistance import transport, server, types, trace, metrics
 
 import clang.cindex as cindex
-import glob, os, subprocess
+import glob, os, subprocess, time, threading
 
 _did_libclang_config = False
 _global_sysinclude = None
@@ -63,44 +63,139 @@ def config_libclang():
 class Service(transport.Service, transport.Project):
     language = 'c'
 
+    # Diagnostics also depend on included headers and the build system
+    cacheable = False
+
+    # Build the precompiled preamble on the first parse instead of the
+    # first reparse (libclang >= 3.8, ignored by older versions)
+    PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE = 0x100
+
+    # Translation unit parse options by profile, selected with the
+    # 'parse_profile' parse option. The editing profile caches the
+    # preamble (the headers included at the top of a source file) so that
+    # reparses after an edit only process the source file itself.
+    profiles = {
+        'minimal': cindex.TranslationUnit.PARSE_NONE,
+        'editing': cindex.TranslationUnit.PARSE_PRECOMPILED_PREAMBLE |
+                   cindex.TranslationUnit.PARSE_CACHE_COMPLETION_RESULTS |
+                   PARSE_CREATE_PREAMBLE_ON_FIRST_PARSE,
+    }
+
+    profile = 'editing'
+
     def __init__(self):
         super(Service, self).__init__()
 
         config_libclang()
 
         self.index = cindex.Index.create(True)
-        self.makefile = makefileintegration.MakefileIntegration()
+
+        # Prefer a compilation database over scraping flags from make
+        self.flags = flags.Providers([compiledb.CompilationDatabaseIntegration(),
+                                      makefileintegration.MakefileIntegration()])
+
+        # The number of documents using the flags of a path. A shared service
+        # has a document for the same path for every app which opened it.
+        self._flags_refs = {}
+        self._flags_lock = threading.Lock()
+
+        # Translation units are persisted in the disk cache budget, the
+        # diagnostics themselves are not cacheable
+        if server.disk_cache_size > 0:
+            self.astcache = astcache.ASTCache(server.disk_cache_size * 1024 * 1024)
+        else:
+            self.astcache = None
+
+    def _parse_options(self, options):
+        try:
+            return Service.profiles[options['parse_profile']]
+        except KeyError:
+            return Service.profiles[self.profile]
 
     def _parse(self, doc, docs, unsaved, options):
-        if (not doc.tu is None) and not self.makefile.changed_for_file(doc.path):
-            doc.tu.reparse(unsaved)
+        tu_options = self._parse_options(options)
+        started = time.time()
+
+        if (not doc.tu is None) and doc.tu_options == tu_options and not self.flags.changed_for_file(doc.path):
+            with metrics.default.timed('reparse'), trace.span('reparse', path=doc.path):
+                doc.tu.reparse(unsaved)
         else:
             global _global_sysinclude
 
-            args = self.makefile.flags_for_file(doc.path)
+            self._ref_flags(doc)
+
+            with trace.span('flags', path=doc.path):
+                args = self.flags.flags_for_file(doc.path, doc.cancellable)
 
             if not _global_sysinclude is None:
                 args = list(args)
                 args.append('-isystem')
                 args.append(_global_sysinclude)
 
-            doc.tu = cindex.TranslationUnit.from_source(doc.path,
-                                                        args=args,
-                                                        unsaved_files=unsaved,
-                                                        index=self.index)
+            doc.cancellable.raise_if_cancelled()
+
+            if not self.astcache is None:
+                doc.tu_key = self.astcache.key(doc.path, args, tu_options)
+
+            if self._load(doc, unsaved):
+                with trace.span('process', path=doc.path):
+                    return self._process(doc, docs)
+
+            with metrics.default.timed('first_parse'), trace.span('from_source', path=doc.path):
+                doc.tu = cindex.TranslationUnit.from_source(doc.path,
+                                                            args=args,
+                                                            unsaved_files=unsaved,
+                                                            options=tu_options,
+                                                            index=self.index)
+
+            doc.tu_options = tu_options
+
+        doc.tu_diagnostics = None
+
+        # Only translation units of the on disk contents can be persisted
+        doc.tu_parsed = started if len(unsaved) == 0 else None
+
+        with trace.span('process', path=doc.path):
+            return self._process(doc, docs)
+
+    def _load(self, doc, unsaved):
+        if self.astcache is None or len(unsaved) != 0:
+            return False
+
+        with trace.span('ast_load', path=doc.path):
+            loaded = self.astcache.load(doc.tu_key, self.index)
+
+        if loaded is None:
+            metrics.default.count('ast_cache_misses')
+            return False
+
+        metrics.default.count('ast_cache_hits')
 
-        for u in unsaved:
-            u[1].close()
+        doc.tu, doc.tu_diagnostics = loaded
 
-        return self._process(doc, docs)
+        # Translation units loaded from an AST cannot be reparsed, the next
+        # parse builds a new one from source. The entry is up to date already.
+        doc.tu_options = None
+        doc.tu_parsed = None
+
+        return True
+
+    def save(self, doc):
+        if self.astcache is None or doc.tu is None or doc.tu_parsed is None:
+            return
+
+        with trace.span('ast_save', path=doc.path):
+            self.astcache.store(doc.tu_key, doc.tu, doc.path, doc.tu_diagnostics, doc.tu_parsed)
+
+        doc.tu_parsed = None
 
     def parse_all(self, doc, docs, options):
-        unsaved = [(d.path, open(d.data_path, 'rb')) for d in docs if d.data_path != d.path]
+        unsaved = [(d.path, d.read()) for d in docs if d.data_path != d.path]
         return self._parse(doc, docs, unsaved, options)
 
     def parse(self, doc, options):
         if doc.data_path != doc.path:
-            unsaved = [(doc.path, open(doc.data_path, 'rb'))]
+            unsaved = [(doc.path, doc.read())]
         else:
             unsaved = []
 
@@ -129,14 +224,17 @@ class Service(transport.Service, transport.Project):
         # Add also our own doc
         incdocs[os.path.realpath(doc.path)] = doc
 
-        self._process_diagnostics(doc.tu, incdocs)
+        if doc.tu_diagnostics is None:
+            doc.tu_diagnostics = self._map_diagnostics(doc.tu)
 
-        return list(incdocs.values())
+        for k, v in incdocs.items():
+            v.diagnostics = list(doc.tu_diagnostics.get(k, []))
 
-    def _process_diagnostics(self, tu, docmap):
-        for k, v in docmap.items():
-            v.diagnostics = []
+        return list(incdocs.values())
 
+    def _map_diagnostics(self, tu):
+        """map the diagnostics of tu by real file path."""
+        ret = {}
         resolved = {}
 
         for d in tu.diagnostics:
@@ -152,15 +250,54 @@ class Service(transport.Service, transport.Project):
                 resolved[f] = rf
 
             try:
-                rdoc = docmap[rf]
+                ret[rf].append(self._map_cdiagnostic(d))
             except KeyError:
-                continue
+                ret[rf] = [self._map_cdiagnostic(d)]
+
+        return ret
 
-            rdoc.diagnostics.append(self._map_cdiagnostic(d))
+    def evict(self, doc):
+        # The translation unit is rebuilt from scratch (or loaded from the
+        # AST cache) on the next parse
+        try:
+            self.save(doc)
+        finally:
+            doc.tu = None
 
     def dispose(self, doc):
-        self.makefile.dispose(doc.path)
-        doc.tu = None
+        try:
+            self.save(doc)
+        finally:
+            self._unref_flags(doc)
+            doc.tu = None
+
+    def _ref_flags(self, doc):
+        if doc.flags_ref:
+            return
+
+        with self._flags_lock:
+            self._flags_refs[doc.path] = self._flags_refs.get(doc.path, 0) + 1
+
+        doc.flags_ref = True
+
+    def _unref_flags(self, doc):
+        if not doc.flags_ref:
+            return
+
+        doc.flags_ref = False
+
+        with self._flags_lock:
+            n = self._flags_refs[doc.path] - 1
+
+            if n > 0:
+                self._flags_refs[doc.path] = n
+                return
+
+            del self._flags_refs[doc.path]
+
+            # Only forget about the flags once no app has the file open
+            # anymore
+            self.flags.dispose(doc.path)
 
     def _map_cseverity(self, severity):
         s = types.Diagnostic.Severity
@@ -212,6 +349,18 @@ class Document(transport.Document, transport.Diagnostics):
     def __init__(self):
         super(Document, self).__init__()
         self.tu = None
+        self.tu_options = None
+
+        # The diagnostics of tu by real file path
+        self.tu_diagnostics = None
+
+        # The AST cache key of tu and the time at which it was parsed, None if
+        # it should not be saved
+        self.tu_key = None
+        self.tu_parsed = None
+
+        # Whether the document holds a reference on the flags of its path
+        self.flags_ref = False
 
     def process(self):
         self._process_diagnostics()
@@ -28,13 +28,16 @@ except ImportError:
 
 class Service(transport.Service):
     language = 'json'
+    version = json.__version__
+
+    # Parsing keeps no state, documents can be parsed concurrently
+    workers = 4
 
     def parse(self, doc, options):
         doc.diagnostics = []
 
         try:
-            with open(doc.data_path) as f:
-                json.load(f)
+            json.loads(doc.read().decode('utf-8'))
 
         except json.JSONDecodeError as e:
             start = types.SourceLocation(line=e.lineno, column=e.colno)
@@ -40,11 +40,54 @@ class DynamicImporter(object):
         parser.add_argument('--address', metavar='ADDRESS', type=str,
                             help='the http address to listen on', default=':0')
 
+        parser.add_argument('--workers', metavar='N', type=int,
+                            help='the number of parse worker threads', default=0)
+
+        parser.add_argument('--disk-cache-size', metavar='MB', type=int,
+                            help='the size of the persistent diagnostics (and C translation unit) cache (0 to disable)', default=0)
+
+        parser.add_argument('--shared-service', action='store_true',
+                            help='share a single service instance between all clients')
+
+        parser.add_argument('--linger', metavar='SECONDS', type=int,
+                            help='the time to keep running after the last client has gone', default=0)
+
+        parser.add_argument('--trim-memory', action='store_true',
+                            help='release unused memory while idle')
+
+        parser.add_argument('--memory-budget', metavar='MB', type=int,
+                            help='evict the state of least recently parsed documents above this resident memory (0 for no limit)', default=0)
+
+        parser.add_argument('--profile-slow-ms', metavar='MS', type=int,
+                            help='keep cProfile stats of parses taking longer than MS', default=0)
+
+        parser.add_argument('--profile-dir', metavar='DIR', type=str,
+                            help='the directory to keep profiles in')
+
+        parser.add_argument('--trace', metavar='FILE', type=str,
+                            help='write a chrome trace of parses to FILE (on exit and on SIGUSR1)')
+
         parser.add_argument('args', metavar='ARG', type=str, nargs='*',
                             help='other arguments...')
 
         args = parser.parse_args()
 
+        if not args.trace is None:
+            trace = importlib.import_module('gnome.codeassistance.trace')
+            trace.enable(args.trace)
+
+        profiling = importlib.import_module('gnome.codeassistance.profiling')
+        profiling.slow_ms = args.profile_slow_ms
+        profiling.directory = args.profile_dir
+
+        server = importlib.import_module('gnome.codeassistance.server')
+        server.workers = args.workers
+        server.disk_cache_size = args.disk_cache_size
+        server.shared_service = args.shared_service
+        server.linger = args.linger
+        server.trim_memory = args.trim_memory
+        server.memory_budget = args.memory_budget
+
         transport = importlib.import_module('gnome.codeassistance.transport_' + args.transport)
         transport.address = args.address
 
@@ -0,0 +1,178 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from gi.repository import GLib
+
+import collections, hashlib, threading, json, os
+
+from gnome.codeassistance import types
+
+# Bump whenever the serialized format of cached diagnostics changes
+FORMAT_VERSION = 1
+
+def make_key(path, data, options, version, config=()):
+    """compute a cache key for the diagnostics of a document.
+
+    The key covers everything that a backend parse depends on: the
+    document path, the contents being parsed, the options provided by the
+    client, the version of the backend and the modification times of the
+    configuration files in config, a list of (path, mtime) tuples.
+    """
+    h = hashlib.sha1()
+
+    for v in (path, repr(sorted(options.items())), version, repr(list(config))):
+        h.update(str(v).encode('utf-8'))
+        h.update(b'\0')
+
+    h.update(data)
+    return h.hexdigest()
+
+class Cache:
+    """A bounded, least recently used cache of diagnostics.
+
+    The cache is shared between worker threads and maps keys (see make_key)
+    to lists of types.Diagnostic.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._items = collections.OrderedDict()
+
+    def lookup(self, key):
+        with self._lock:
+            try:
+                diagnostics = self._items.pop(key)
+            except KeyError:
+                return None
+
+            self._items[key] = diagnostics
+            return diagnostics
+
+    def store(self, key, diagnostics):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = list(diagnostics)
+
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+class DiskCache:
+    """A persistent cache of diagnostics.
+
+    Entries are stored in $XDG_CACHE_HOME/gnome-code-assistance/<name> as
+    JSON serialized diagnostic tuples, one file per key, so that diagnostics
+    survive restarts of the daemon. The total size of the cache is bounded
+    by size (in bytes). The modification time of an entry is updated
+    whenever it is used and the least recently used entries are evicted
+    first.
+    """
+
+    def __init__(self, name, size):
+        self.path = os.path.join(GLib.get_user_cache_dir(), 'gnome-code-assistance', name)
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._total = None
+
+    def _filename(self, key):
+        return os.path.join(self.path, '{0}-{1}.json'.format(key, FORMAT_VERSION))
+
+    def lookup(self, key):
+        filename = self._filename(key)
+
+        try:
+            with open(filename) as f:
+                tps = json.load(f)
+
+            os.utime(filename, None)
+        except (IOError, OSError, ValueError):
+            return None
+
+        return [types.Diagnostic.from_tuple(tp) for tp in tps]
+
+    def store(self, key, diagnostics):
+        filename = self._filename(key)
+        tmpname = '{0}.{1}.tmp'.format(filename, threading.current_thread().ident)
+
+        data = json.dumps([d.to_tuple() for d in diagnostics])
+
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+
+            with open(tmpname, 'w') as f:
+                f.write(data)
+
+            os.rename(tmpname, filename)
+        except (IOError, OSError):
+            return
+
+        with self._lock:
+            if self._total is None:
+                self._total = sum(e[1] for e in self._entries())
+            else:
+                self._total += len(data)
+
+            if self._total > self.size:
+                self._evict()
+
+    def _entries(self):
+        ret = []
+
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return ret
+
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+
+            filename = os.path.join(self.path, name)
+
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+
+            ret.append((st.st_mtime, st.st_size, filename))
+
+        return ret
+
+    def _evict(self):
+        entries = self._entries()
+        entries.sort()
+
+        self._total = sum(e[1] for e in entries)
+
+        # Evict down to 90% so that we do not scan on every store
+        target = self.size * 0.9
+
+        for mtime, size, filename in entries:
+            if self._total <= target:
+                break
+
+            try:
+                os.unlink(filename)
+            except OSError:
+                continue
+
+            self._total -= size
+
+# ex:ts=4:et:
@@ -0,0 +1,174 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Performance metrics of the python backends.
+
+The server exports its metrics on the org.gnome.CodeAssist.v1.Metrics
+interface of the service object. They can be dumped as JSON with:
+
+    python3 -m gnome.codeassistance.metrics LANGUAGE
+    python3 -m gnome.codeassistance.metrics --http URL
+"""
+
+import collections, contextlib, threading, time, os, json, sys
+
+class Histogram:
+    """A window of the most recent samples, to compute percentiles over."""
+
+    def __init__(self, size=1024):
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=size)
+
+    def add(self, value):
+        with self._lock:
+            self._samples.append(value)
+
+    def percentiles(self, ps):
+        with self._lock:
+            samples = sorted(self._samples)
+
+        if len(samples) == 0:
+            return [0.0 for p in ps]
+
+        # Nearest rank
+        return [samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))] for p in ps]
+
+class Metrics:
+    """Counters and latency histograms of a server.
+
+    Metrics are updated from both the main loop and the worker threads.
+    """
+
+    percentiles = (50, 95, 99)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._histograms = collections.defaultdict(Histogram)
+
+        self.started = time.time()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] += n
+
+    def record(self, name, ms):
+        with self._lock:
+            histogram = self._histograms[name]
+
+        histogram.add(ms)
+
+    @contextlib.contextmanager
+    def timed(self, name):
+        """count and time a block of code.
+
+        The duration is recorded in the name histogram and the number of
+        times the block was entered in the name + 's' counter. Blocks which
+        raise are counted in name + '_errors'.
+        """
+        self.count(name + 's')
+        start = time.time()
+
+        try:
+            yield
+        except Exception:
+            self.count(name + '_errors')
+            raise
+        finally:
+            self.record(name, (time.time() - start) * 1000)
+
+    def snapshot(self):
+        """get the current metrics as a flat dictionary.
+
+        Latencies are reported in milliseconds as <name>_ms_p<percentile>.
+        """
+        with self._lock:
+            ret = dict(self._counters)
+            histograms = dict(self._histograms)
+
+        for name in histograms:
+            values = histograms[name].percentiles(Metrics.percentiles)
+
+            for p, v in zip(Metrics.percentiles, values):
+                ret['{0}_ms_p{1}'.format(name, p)] = v
+
+        ret['uptime_s'] = time.time() - self.started
+        ret['rss_bytes'] = rss()
+
+        return ret
+
+# The metrics of the process, which backends can add their own metrics to
+default = Metrics()
+
+def rss():
+    """get the resident memory of the process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        import resource
+
+        # Not linux, use the peak instead
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def fetch_dbus(language):
+    import dbus
+
+    bus = dbus.SessionBus()
+
+    obj = bus.get_object('org.gnome.CodeAssist.v1.' + language,
+                         '/org/gnome/CodeAssist/v1/' + language)
+
+    metrics = obj.Metrics(dbus_interface='org.gnome.CodeAssist.v1.Metrics')
+    return {str(k): metrics[k] for k in metrics}
+
+def fetch_http(url):
+    import urllib.request
+
+    body = json.dumps({'args': []}).encode('utf-8')
+    req = urllib.request.Request(url.rstrip('/') + '/Metrics', body, {'Content-Type': 'application/json'})
+
+    with urllib.request.urlopen(req) as f:
+        return json.loads(f.read().decode('utf-8'))['result']
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='dump the metrics of a gnome code assistance backend as JSON')
+
+    parser.add_argument('language', metavar='LANGUAGE', type=str, nargs='?',
+                        help='the language of the backend (on the session bus)')
+
+    parser.add_argument('--http', metavar='URL', type=str,
+                        help='the url of the service object of a backend using the http transport')
+
+    args = parser.parse_args()
+
+    if not args.http is None:
+        metrics = fetch_http(args.http)
+    elif not args.language is None:
+        metrics = fetch_dbus(args.language)
+    else:
+        parser.error('either LANGUAGE or --http is required')
+
+    json.dump(metrics, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
+
+# ex:ts=4:et:
@@ -0,0 +1,157 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Profiling of slow parses.
+
+When enabled (with --profile-slow-ms N), backend parses are run under
+cProfile and the stats of every parse taking longer than N milliseconds are
+written to the profile directory (--profile-dir, by default
+$XDG_CACHE_HOME/gnome-code-assistance/profiles). Each profile is named after
+the backend, a hash of the document path and a hash of the parse options,
+and comes with a JSON file describing the parse. Only the most recent
+profiles are kept.
+
+Profiles can be inspected with python3 -m pstats FILE.
+"""
+
+import cProfile, threading, hashlib, time, json, os
+
+# Minimum duration in ms of a parse for its profile to be kept, 0 disables
+# profiling
+slow_ms = 0
+
+# The directory to write profiles to, None for the default
+directory = None
+
+# The maximum number of profiles kept in the directory
+keep = 50
+
+# Only a single profiler can be active at a time, parses running
+# concurrently with a profiled one are not profiled
+_lock = threading.Lock()
+
+def profile_directory():
+    if not directory is None:
+        return directory
+
+    from gi.repository import GLib
+    return os.path.join(GLib.get_user_cache_dir(), 'gnome-code-assistance', 'profiles')
+
+def _hash(s):
+    return hashlib.sha1(s.encode('utf-8')).hexdigest()[:12]
+
+class Profile:
+    def __init__(self, name, path, options):
+        self.name = name
+        self.path = path
+        self.options = options
+
+        self.profiler = None
+
+    def __enter__(self):
+        if _lock.acquire(False):
+            self.profiler = cProfile.Profile()
+
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler (e.g. a debugger) is active
+                self.profiler = None
+                _lock.release()
+
+        self.start = time.time()
+        return self
+
+    def __exit__(self, typ, value, tb):
+        if self.profiler is None:
+            return False
+
+        self.profiler.disable()
+        _lock.release()
+
+        ms = (time.time() - self.start) * 1000
+
+        if ms >= slow_ms:
+            try:
+                self.write(ms)
+            except (IOError, OSError):
+                pass
+
+        return False
+
+    def write(self, ms):
+        d = profile_directory()
+
+        if not os.path.isdir(d):
+            os.makedirs(d)
+
+        options = repr(sorted(self.options.items()))
+        base = '{0}-{1}-{2}-{3}'.format(self.name, int(self.start * 1000), _hash(self.path), _hash(options))
+        filename = os.path.join(d, base + '.prof')
+
+        self.profiler.dump_stats(filename)
+
+        with open(os.path.join(d, base + '.json'), 'w') as f:
+            json.dump({'backend': self.name,
+                       'path': self.path,
+                       'options': options,
+                       'duration_ms': ms,
+                       'time': self.start}, f, indent=2)
+
+        rotate(d)
+
+def rotate(d):
+    profiles = []
+
+    for name in os.listdir(d):
+        if name.endswith('.prof'):
+            filename = os.path.join(d, name)
+
+            try:
+                profiles.append((os.stat(filename).st_mtime, filename))
+            except OSError:
+                pass
+
+    profiles.sort()
+
+    for mtime, filename in profiles[:max(0, len(profiles) - keep)]:
+        for f in (filename, filename[:-len('.prof')] + '.json'):
+            try:
+                os.unlink(f)
+            except OSError:
+                pass
+
+class NullProfile:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, tb):
+        return False
+
+_null_profile = NullProfile()
+
+def profile(name, path, options):
+    """profile a parse of the document at path.
+
+    The profile is kept if the parse takes longer than slow_ms.
+    """
+    if slow_ms <= 0:
+        return _null_profile
+
+    return Profile(name, path, options)
+
+# ex:ts=4:et:
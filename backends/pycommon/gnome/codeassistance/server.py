@@ -0,0 +1,1002 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Transport independent parts of the python backends.
+
+The transports (see transport_dbus and transport_http) expose a Server to
+clients. The Server keeps track of client apps and their documents, and
+schedules parses of documents on a worker pool. All Server state is only
+ever touched from the GLib main loop.
+"""
+
+from gi.repository import GLib
+
+import sys, os, stat, mmap, gc, ctypes, ctypes.util, hashlib, collections, contextlib, time
+
+from gnome.codeassistance import types, worker, cache, metrics, trace, profiling
+
+# Number of parse worker threads, 0 means use the service default
+workers = 0
+
+# Size in MB of the persistent diagnostics cache, 0 disables the cache
+disk_cache_size = 0
+
+# Whether all client apps share a single Service instance (see Service.shared)
+shared_service = False
+
+# Number of seconds to keep running after the last client app has gone, 0
+# means exit right away
+linger = 0
+
+# Whether to release unused memory back to the system while lingering
+trim_memory = False
+
+# Size in MB of resident memory above which the per document state of the
+# least recently parsed documents is evicted, 0 means no limit
+memory_budget = 0
+
+# Number of seconds without any parse after which the state of the open
+# documents is saved (see Service.save)
+save_delay = 10
+
+# The initial generation of the diagnostics of documents. It differs for every
+# process, so that a generation obtained from an earlier instance of the
+# backend is not mistaken for one of the current instance.
+generation_base = int(time.time() * 1000) << 16
+
+def release_memory():
+    """collect garbage and return free heap memory to the system."""
+    gc.collect()
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'))
+        libc.malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        # Not glibc
+        pass
+
+class Buffer:
+    """The contents of an unsaved document passed as a file descriptor.
+
+    The buffer takes ownership of fd, which should refer to a regular file or
+    a (sealed) memfd. The contents are mapped into memory instead of being
+    copied, and child processes can open them through path.
+    """
+
+    def __init__(self, fd):
+        try:
+            st = os.fstat(fd)
+        except OSError:
+            os.close(fd)
+            raise
+
+        if not stat.S_ISREG(st.st_mode):
+            os.close(fd)
+            raise ValueError('the file descriptor of a document should refer to a regular file or memfd')
+
+        self.fd = fd
+        self.path = '/proc/{0}/fd/{1}'.format(os.getpid(), fd)
+
+        if st.st_size > 0:
+            self.data = mmap.mmap(fd, st.st_size, access=mmap.ACCESS_READ)
+        else:
+            # Empty files cannot be mapped
+            self.data = b''
+
+    def close(self):
+        if self.fd is None:
+            return
+
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+        os.close(self.fd)
+
+        self.fd = None
+        self.data = None
+
+class Document(object):
+    """Base document.
+
+    Transports provide a subclass which exposes the document to clients.
+    """
+
+    def __init__(self):
+        super(Document, self).__init__()
+
+        self.id = 0
+        self.path = ''
+        self.client_path = ''
+        self.data_path = ''
+        self.data = None
+        self.cursor = types.SourceLocation()
+        self.cancellable = worker.Cancellable()
+
+    def read(self):
+        """read the contents of the document being parsed.
+
+        Backends analysing documents in process should use this instead of
+        opening data_path themselves. The contents of documents passed as a
+        file descriptor are taken directly from memory.
+        """
+        with trace.span('read', path=self.path):
+            if not self.data is None:
+                return self.data[:]
+
+            with open(self.data_path, 'rb') as f:
+                return f.read()
+
+class Diagnostics(object):
+    """Diagnostics of a document.
+
+    Diagnostics are served from the .diagnostics field which should be set
+    to a list of types.Diagnostic objects.
+
+    Whenever the published diagnostics differ from the previously published
+    ones, the generation is increased and changed() is called. Each published
+    diagnostic gets a stable id, derived from its contents, so that clients
+    holding a generation can ask for only the diagnostics added and removed
+    since (see diagnostics_since).
+
+    The wire representation of the diagnostics is computed once, off the
+    main loop, before they are published and reused for every request until
+    a different set of diagnostics is published.
+    """
+
+    # The number of past generations for which diagnostics_since can compute
+    # a delta
+    history_size = 16
+
+    def __init__(self):
+        super(Diagnostics, self).__init__()
+
+        self.diagnostics = []
+        self.published_diagnostics = []
+        self.generation = generation_base
+
+        self._diagnostic_tuples = []
+        self._diagnostic_ids = []
+
+        # The published diagnostics with their tuples and ids, replaced as a
+        # whole so that it can be read consistently off the main loop
+        self._published = ([], [], [])
+
+        self._history = collections.OrderedDict()
+        self._history[self.generation] = frozenset()
+
+        self._prepared = None
+
+    def _make_diagnostic_ids(self, tuples):
+        ids = []
+        occurrences = {}
+
+        for tp in tuples:
+            # Identical diagnostics are told apart by their occurrence
+            r = repr(tp)
+            n = occurrences.get(r, 0)
+            occurrences[r] = n + 1
+
+            h = hashlib.sha1('{0}:{1}'.format(n, r).encode('utf-8'))
+            ids.append(int(h.hexdigest()[:16], 16))
+
+        return ids
+
+    def prepare_diagnostics(self):
+        """serialize the current diagnostics for the next publish.
+
+        This is called by the server off the main loop, right after a parse
+        has finished, so that publish_diagnostics has little work left to do
+        on the main loop.
+        """
+        self._prepared = [self._prepare()]
+
+    def _prepare(self):
+        diagnostics = list(self.diagnostics)
+
+        # Whether the diagnostics actually changed is only decided on the
+        # main loop (see _publish), a partial publish may still be pending
+        published, tuples, ids = self._published
+
+        if self._same_diagnostics(diagnostics, published):
+            return (diagnostics, tuples, ids)
+
+        tuples = [d.to_tuple() for d in diagnostics]
+        return (diagnostics, tuples, self._make_diagnostic_ids(tuples))
+
+    def publish_diagnostics(self):
+        """make the current diagnostics available to clients.
+
+        Parsing happens off the main loop, so .diagnostics may be in the
+        middle of being populated at any time. The server calls this once a
+        parse of the document has finished, and only the published diagnostics
+        are served to clients.
+        """
+        prepared = self._prepared
+        self._prepared = None
+
+        if prepared is None:
+            prepared = [self._prepare()]
+
+        self._publish(prepared[0])
+
+    def publish_partial(self):
+        """publish the diagnostics gathered so far, while still parsing.
+
+        Backends running several checkers can call this from Service.parse
+        after each but the last checker, so that clients get the results of
+        fast checkers without waiting for the slow ones. The diagnostics are
+        published on the main loop, unless the parse has been cancelled or
+        superseded by then (see Document.cancellable).
+        """
+        cancellable = self.cancellable
+
+        if cancellable.is_cancelled():
+            return
+
+        with trace.span('serialize', path=self.path, partial=True):
+            prepared = self._prepare()
+
+        def publish():
+            if not cancellable.is_cancelled():
+                self._publish(prepared)
+
+            return False
+
+        GLib.idle_add(publish)
+
+    def _publish(self, prepared):
+        diagnostics, tuples, ids = prepared
+
+        # The final diagnostics of a parse are often the same as the last
+        # partially published ones
+        if tuples == self._diagnostic_tuples:
+            return
+
+        self.published_diagnostics = diagnostics
+        self._diagnostic_tuples = tuples
+        self._diagnostic_ids = ids
+
+        self._published = (diagnostics, tuples, ids)
+
+        self.generation += 1
+        self._history[self.generation] = frozenset(self._diagnostic_ids)
+
+        while len(self._history) > self.history_size:
+            self._history.popitem(last=False)
+
+        self.changed(self.generation)
+
+    def _same_diagnostics(self, diagnostics, published):
+        # Diagnostics reused from the cache are the very same objects as the
+        # published ones, which avoids serializing them again
+        if len(diagnostics) != len(published):
+            return False
+
+        for a, b in zip(diagnostics, published):
+            if not a is b:
+                return False
+
+        return True
+
+    def changed(self, generation):
+        """called when newly published diagnostics differ from the old ones.
+
+        Transports override this to notify clients.
+        """
+        pass
+
+    def serialized_diagnostics(self):
+        return self._diagnostic_tuples
+
+    def diagnostics_since(self, generation):
+        """compute the changes to the diagnostics since generation.
+
+        Returns a tuple of the current generation, a list of (id, diagnostic
+        tuple) added since generation, a list of ids removed since generation
+        and whether the delta could not be computed, in which case all
+        current diagnostics are returned as added.
+        """
+        current = list(zip(self._diagnostic_ids, self._diagnostic_tuples))
+
+        if generation == 0:
+            # The client does not have any diagnostics yet
+            return (self.generation, current, [], False)
+
+        try:
+            since = self._history[generation]
+        except KeyError:
+            # Unknown or too old generation, send everything
+            return (self.generation, current, [], True)
+
+        ids = frozenset(self._diagnostic_ids)
+
+        added = [(i, tp) for i, tp in current if not i in since]
+        removed = [i for i in since if not i in ids]
+
+        return (self.generation, added, removed, False)
+
+class Service:
+    language = None
+
+    # The number of documents that may be parsed concurrently. Parsing always
+    # happens off the main loop, but backends need to be thread safe to use
+    # more than a single worker.
+    workers = 1
+
+    # Whether the diagnostics of a document only depend on its contents, its
+    # path and the parse options. If so, the transport reuses diagnostics for
+    # contents it has seen before instead of calling parse. The version is
+    # part of the cache key and should change whenever the analysis does.
+    cacheable = True
+    version = ''
+
+    # Whether all client apps share a single instance of the service, instead
+    # of each app getting its own. Documents stay separate for every app, but
+    # any analysis state kept by the service (and its caches) is shared. This
+    # is also enabled for every service with --shared-service. Shared services
+    # are used concurrently for different apps if workers > 1.
+    shared = False
+
+    def config_files(self, doc):
+        """list configuration files affecting the diagnostics of a document.
+
+        The modification times of these files are part of the diagnostics
+        cache key, so that cached diagnostics are not reused after the
+        configuration has changed. Files which do not exist may be listed
+        as well, in case they are created later.
+        """
+        return []
+
+    def cacheable_with(self, options):
+        """whether diagnostics are cacheable when parsing with options.
+
+        Services whose diagnostics only depend on other files with some
+        options can override this to bypass the cache for those options.
+        """
+        return self.cacheable
+
+    def parse(self, doc, options):
+        """parse a single document.
+
+        parse should be implemented to parse the file located at @path
+        into the provided @doc. @data_path contains the path of the actual data
+        needed to be parsed. If the document is in an unmodified state, then
+        @data_path will be equal to @path. However, if the document is being
+        edited, then @data_path will be a temporary file containing the modified
+        document. @cursor is the current location of the cursor in the document
+        being edited. The @cursor can be used to gather autocompletion
+        information. Finally @options contains backend specific options provided
+        by a client.
+
+        @doc.cancellable is cancelled when a newer parse of the document
+        supersedes this one, or when the document is disposed. Long running
+        implementations should call doc.cancellable.raise_if_cancelled()
+        between stages, and kill child processes from a callback connected
+        with doc.cancellable.connect().
+
+        @doc is an object of the register document type and should be populated
+        by the implementation.
+        """
+        pass
+
+    def evict(self, doc):
+        """release the analysis state of a document to save memory.
+
+        evict is called for the least recently parsed documents when the
+        server exceeds its memory budget (see --memory-budget). The document
+        itself stays alive and keeps its diagnostics, but any heavy state kept
+        for it (e.g. a translation unit) should be released, to be rebuilt on
+        the next parse. evict is called off the main loop, never concurrently
+        with a parse of the same document.
+        """
+        pass
+
+    def save(self, doc):
+        """persist the analysis state of a document.
+
+        save is called for the open documents once the server has not parsed
+        anything for a while, so that state which is otherwise only persisted
+        on dispose or evict survives the daemon being killed. save is called
+        off the main loop at a low priority, never concurrently with a parse
+        of the same document.
+        """
+        pass
+
+    def dispose(self, doc):
+        pass
+
+class Project:
+    def parse_all(self, doc, docs, options):
+        """parse multiple documents.
+
+        parse_all potentially parses multiple documents at the same time.
+        This can be implemented by backends which parse multiple documents at
+        the same time to complete a parse. This is useful for example for
+        parsers that can provide semantic diagnostics based on types of a
+        complete unit instead of only providing syntactic analysis. Examples of
+        languages that should support this are C, Vala or Go (i.e. languages
+        with static typing).
+
+        doc: the primary document needing to be parsed. This is the document
+        requesting analysis and can be used as the starting point for
+        analysis.
+
+        docs: a list of documents which the client is interested in (i.e.
+        these are usually the documents open in the client). An implementation
+        can provide information for the subset of these docs that were analysed
+        in the process of analysing doc. Note that docs always includes at
+        least doc.
+
+        options: an implementation specific set of options passed by the client
+
+        doc.cancellable is cancelled when the parse is superseded (see
+        Service.parse).
+
+        Implementations should do the following steps:
+          1) Determine all the documents belonging to the project of doc
+          2) Parse and analyse these documents in the context of doc
+          3) Gather and supply information to the intersection between documents
+             in docs and the project documents that were processed.
+          4) Return the subset of documents which have newly processed information
+
+        """
+        pass
+
+class Server(object):
+    """Transport independent server.
+
+    Transports subclass this and override export_document and
+    unexport_document to make documents available to clients.
+    """
+
+    class App:
+        def __init__(self):
+            self.id = 0
+            self.name = ''
+
+            self.docs = {}
+            self.nextid = 0
+            self.service = None
+
+    def __init__(self):
+        self.apps = {}
+        self.nextid = 0
+        self.cache = cache.Cache()
+        self.metrics = metrics.default
+        self.shared_instance = None
+
+        # Pending exit after the last app has gone (see linger), and the
+        # number of times it was called off because a new app arrived
+        self.linger_source = 0
+        self.warm_starts = 0
+
+        # Documents in order of their last parse, oldest first, for evicting
+        # their state when over the memory budget
+        self.recent = collections.OrderedDict()
+        self.evicting = False
+
+        # Pending save of the open documents (see save_documents)
+        self.save_source = 0
+
+    def run(self, service, document):
+        self.service = service
+        self.document = document
+
+        self.pool = worker.Pool(workers or service.workers)
+
+        if disk_cache_size > 0:
+            self.disk_cache = cache.DiskCache(service.language, disk_cache_size * 1024 * 1024)
+        else:
+            self.disk_cache = None
+
+        ml = GLib.MainLoop()
+        ml.run()
+
+    def make_app(self, appid):
+        if self.linger_source != 0:
+            GLib.source_remove(self.linger_source)
+
+            self.linger_source = 0
+            self.warm_starts += 1
+
+        app = Server.App()
+
+        app.id = self.nextid
+        app.name = appid
+        app.service = self.make_service()
+
+        self.apps[appid] = app
+        self.nextid += 1
+
+        return app
+
+    def make_service(self):
+        if not (shared_service or self.service.shared):
+            return self.service()
+
+        if self.shared_instance is None:
+            self.shared_instance = self.service()
+
+        return self.shared_instance
+
+    def ensure_app(self, appid):
+        try:
+            return self.apps[appid]
+        except KeyError:
+            return self.make_app(appid)
+
+    def make_document(self, app, path, client_path):
+        doc = self.document()
+
+        doc.id = app.nextid
+        doc.client_path = client_path
+        doc.path = path
+
+        app.nextid += 1
+        app.docs[path] = doc
+
+        self.export_document(app, doc)
+
+        return doc
+
+    def export_document(self, app, doc):
+        pass
+
+    def unexport_document(self, doc):
+        pass
+
+    def ensure_document(self, app, path):
+        npath = (path and os.path.normpath(path))
+
+        try:
+            return app.docs[npath]
+        except KeyError:
+            return self.make_document(app, npath, path)
+
+    def update_document(self, doc, data_path, cursor=None, cancellable=None, data=None):
+        doc.data_path = (data_path or doc.client_path)
+        doc.data = data
+        doc.cursor = cursor or types.SourceLocation()
+        doc.cancellable = cancellable or worker.Cancellable()
+
+    def scheduling(self, options, priority):
+        """determine the scheduling priority of a request.
+
+        Clients pass the 'focused' option for the document being edited, or
+        an explicit 'priority' (lower runs first, see worker.PRIORITY_DEFAULT),
+        otherwise priority is used. Returns the priority and the options
+        without the scheduling options, which are not passed on to the
+        service.
+        """
+        if 'priority' in options:
+            priority = int(options['priority'])
+        elif 'focused' in options and options['focused']:
+            priority = worker.PRIORITY_HIGH
+
+        options = {k: v for k, v in options.items() if not k in ('priority', 'focused')}
+        return priority, options
+
+    def parse(self, appid, path, data_path, cursor, options, reply_cb, error_cb, buf=None,
+              priority=worker.PRIORITY_DEFAULT):
+        """parse a single document for a client app.
+
+        The contents of the document are either read from data_path or, if
+        buf is not None, taken from buf (see Buffer). The buffer is closed
+        once the parse has finished. reply_cb is called with the document
+        once it has been parsed. priority is the default priority of the
+        parse (see scheduling).
+        """
+        with trace.span('dispatch', method='parse', path=path):
+            self._parse(appid, path, data_path, cursor, options, reply_cb, error_cb, buf, priority)
+
+    def _parse(self, appid, path, data_path, cursor, options, reply_cb, error_cb, buf, priority):
+        try:
+            priority, options = self.scheduling(options, priority)
+
+            app = self.ensure_app(appid)
+            doc = self.ensure_document(app, path)
+            cursor = types.SourceLocation.from_tuple(cursor)
+        except:
+            # The buffer is only closed by the callbacks once scheduled
+            if not buf is None:
+                buf.close()
+
+            raise
+
+        cancellable = worker.Cancellable()
+
+        def parse():
+            if buf is None:
+                self.update_document(doc, data_path, cursor, cancellable)
+            else:
+                self.update_document(doc, buf.path, cursor, cancellable, buf.data)
+
+            try:
+                self.parse_document(app, doc, options)
+            finally:
+                if not buf is None:
+                    # The buffer is closed after the parse, do not leave
+                    # the document pointing at it
+                    self.update_document(doc, '', cursor, cancellable)
+
+            return [doc]
+
+        def done(cb, arg):
+            # A parse superseded before it ran does not run at all, but its
+            # callbacks are always called
+            if not buf is None:
+                buf.close()
+
+            cb(arg)
+
+        def reply(parsed):
+            self.parsed(app, doc)
+            done(reply_cb, doc)
+
+        self.schedule([doc], parse, reply, lambda e: done(error_cb, e),
+                      tag=('parse', doc), cancellable=cancellable, priority=priority)
+
+    def parse_many(self, appid, documents, options, reply_cb, error_cb):
+        """parse a batch of independent documents for a client app.
+
+        documents is a list of (path, data_path, cursor) tuples. Each document
+        is parsed as if by parse, so the batch is spread over the worker pool.
+        Batches run at a low priority unless the options say otherwise.
+        reply_cb is called with the list of parsed documents, in the same
+        order, once all of them have been parsed. If any of the parses fails,
+        error_cb is called with the first error instead.
+        """
+        if len(documents) == 0:
+            reply_cb([])
+            return
+
+        parsed = [None] * len(documents)
+        remaining = [len(documents)]
+        failed = [False]
+
+        def done(i, doc):
+            parsed[i] = doc
+            remaining[0] -= 1
+
+            if remaining[0] == 0 and not failed[0]:
+                reply_cb(parsed)
+
+        def error(e):
+            if not failed[0]:
+                failed[0] = True
+                error_cb(e)
+
+        for i, (path, data_path, cursor) in enumerate(documents):
+            self.parse(appid, path, data_path, cursor, options,
+                       lambda doc, i=i: done(i, doc), error, priority=worker.PRIORITY_LOW)
+
+    def parse_all(self, appid, path, documents, cursor, options, reply_cb, error_cb):
+        """parse a document in the context of other open documents.
+
+        documents is a list of (path, data_path) tuples. reply_cb is called
+        with the list of documents for which new information is available.
+        Parsing all documents is done in the background, at a low priority,
+        unless the options say otherwise.
+        """
+        with trace.span('dispatch', method='parse_all', path=path):
+            self._parse_all(appid, path, documents, cursor, options, reply_cb, error_cb)
+
+    def _parse_all(self, appid, path, documents, cursor, options, reply_cb, error_cb):
+        priority, options = self.scheduling(options, worker.PRIORITY_LOW)
+
+        app = self.ensure_app(appid)
+        doc = self.ensure_document(app, path)
+        cursor = types.SourceLocation.from_tuple(cursor)
+
+        opendocs = [types.OpenDocument.from_tuple(d) for d in documents]
+        docs = [(self.ensure_document(app, d.path), d.data_path) for d in opendocs]
+        cancellable = worker.Cancellable()
+
+        def parse_all():
+            self.update_document(doc, '', cursor, cancellable)
+
+            for d, data_path in docs:
+                self.update_document(d, data_path, cancellable=cancellable)
+
+            with self.measure(doc, options):
+                return app.service.parse_all(doc, [d for d, data_path in docs], options)
+
+        def reply(parsed):
+            self.parsed(app, doc)
+            reply_cb(parsed)
+
+        self.schedule([doc] + [d for d, data_path in docs], parse_all, reply, error_cb,
+                      tag=('parse_all', doc), cancellable=cancellable, priority=priority)
+
+    def parse_document(self, app, doc, options):
+        """parse a single document, reusing cached diagnostics if possible.
+
+        This is run off the main loop.
+        """
+        if not app.service.cacheable_with(options) or not isinstance(doc, Diagnostics):
+            self.parse_service(app, doc, options)
+            return
+
+        try:
+            data = doc.read()
+        except IOError:
+            # Let the backend report on unreadable documents
+            self.parse_service(app, doc, options)
+            return
+
+        config = [(f, self.mtime(f)) for f in app.service.config_files(doc)]
+
+        with trace.span('cache', path=doc.path):
+            key = cache.make_key(doc.path, data, options, app.service.version, config)
+            diagnostics = self.cache.lookup(key)
+
+            if not diagnostics is None:
+                self.metrics.count('cache_memory_hits')
+            elif not self.disk_cache is None:
+                diagnostics = self.disk_cache.lookup(key)
+
+                if not diagnostics is None:
+                    self.metrics.count('cache_disk_hits')
+                    self.cache.store(key, diagnostics)
+
+        if not diagnostics is None:
+            doc.diagnostics = list(diagnostics)
+            return
+
+        self.metrics.count('cache_misses')
+
+        # Let the backend reuse the contents read for the key instead of
+        # reading the document again
+        prev = doc.data
+        doc.data = data
+
+        try:
+            self.parse_service(app, doc, options)
+        finally:
+            doc.data = prev
+
+        self.cache.store(key, doc.diagnostics)
+
+        if not self.disk_cache is None:
+            self.disk_cache.store(key, doc.diagnostics)
+
+    def parse_service(self, app, doc, options):
+        with self.measure(doc, options):
+            app.service.parse(doc, options)
+
+    @contextlib.contextmanager
+    def measure(self, doc, options):
+        """collect metrics, traces and profiles of a backend parse."""
+        with self.metrics.timed('parse'), \
+             trace.span('parse', path=doc.path), \
+             profiling.profile(self.service.language, doc.path, options):
+            yield
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return 0
+
+    def schedule(self, docs, func, reply_cb, error_cb, tag=None, cancellable=None,
+                 priority=worker.PRIORITY_DEFAULT):
+        """schedule func to run on the worker pool.
+
+        func is run off the main loop and should return the list of documents
+        which were parsed. The diagnostics of these documents are published
+        and reply_cb is called with the list once func has finished.
+
+        Editors request a parse on every pause in typing, so requests with
+        the same tag are coalesced: only the most recent one is run and the
+        result of an already running, outdated one is dropped. All coalesced
+        requests are replied to with the result of the most recent one. The
+        cancellable of an outdated request is cancelled.
+
+        Requests are run in order of priority (see worker.Pool), so that the
+        document being edited is not held up by background parses.
+        """
+        queued = trace.now()
+
+        def run():
+            trace.complete('queue', queued, priority=priority)
+            parsed = func()
+
+            for doc in parsed:
+                self.prepare(doc)
+
+            return parsed
+
+        submitted = time.time()
+
+        def finished(parsed, error):
+            self.metrics.count('requests')
+            self.metrics.record('request', (time.time() - submitted) * 1000)
+
+            if not error is None:
+                self.metrics.count('request_errors')
+
+                error_cb(error)
+                return
+
+            for doc in parsed:
+                self.publish(doc)
+
+            reply_cb(parsed)
+
+        self.pool.submit(docs, run, finished, tag, cancellable, priority)
+
+    def metrics_snapshot(self):
+        """get the current metrics of the server (see metrics.Metrics)."""
+        ret = self.metrics.snapshot()
+
+        queued, running = self.pool.stats()
+        hits = ret.get('cache_memory_hits', 0) + ret.get('cache_disk_hits', 0)
+        lookups = hits + ret.get('cache_misses', 0)
+
+        ret.update({
+            'language': self.service.language,
+            'workers': self.pool.size,
+            'queued': queued,
+            'running': running,
+            'apps': len(self.apps),
+            'documents': sum(len(app.docs) for app in self.apps.values()),
+            'warm_starts': self.warm_starts,
+            'cache_hit_rate': (float(hits) / lookups if lookups > 0 else 0.0),
+        })
+
+        return ret
+
+    def prepare(self, doc):
+        if isinstance(doc, Diagnostics):
+            with trace.span('serialize', path=doc.path):
+                doc.prepare_diagnostics()
+
+    def publish(self, doc):
+        if isinstance(doc, Diagnostics):
+            with trace.span('publish', path=doc.path):
+                doc.publish_diagnostics()
+
+    def dispose(self, app, path):
+        try:
+            doc = app.docs[path]
+        except KeyError:
+            return
+
+        self.dispose_document(app, doc)
+        del app.docs[path]
+
+        if len(app.docs) == 0:
+            self.dispose_app(app)
+
+    def parsed(self, app, doc):
+        # The document may have been disposed while it was being parsed
+        if self.apps.get(app.name) is not app or app.docs.get(doc.path) is not doc:
+            return
+
+        self.schedule_save()
+
+        # Services which do not keep any state of their own have nothing to
+        # evict
+        if type(app.service).evict is Service.evict:
+            return
+
+        self.recent.pop(doc, None)
+        self.recent[doc] = app
+
+        self.enforce_memory_budget()
+
+    def enforce_memory_budget(self):
+        """evict document state while over the memory budget.
+
+        Documents are evicted one at a time, least recently parsed first,
+        until the resident memory drops below the budget. The most recently
+        parsed document is never evicted. Evicting stops when it did not
+        lower the resident memory, until the next parse.
+        """
+        if memory_budget <= 0 or self.evicting or len(self.recent) <= 1:
+            return
+
+        rss = metrics.rss()
+
+        if rss <= memory_budget * 1024 * 1024:
+            return
+
+        doc, app = self.recent.popitem(last=False)
+
+        def evict():
+            app.service.evict(doc)
+            release_memory()
+
+        def evicted(ret, error):
+            self.evicting = False
+            self.metrics.count('evictions')
+
+            # The memory is used by something else than document state
+            if metrics.rss() >= rss:
+                return
+
+            self.enforce_memory_budget()
+
+        self.evicting = True
+        self.pool.submit([doc], evict, evicted, priority=worker.PRIORITY_LOW)
+
+    def schedule_save(self):
+        # Services which do not keep any state of their own have nothing to
+        # save
+        if self.service.save is Service.save:
+            return
+
+        if self.save_source != 0:
+            GLib.source_remove(self.save_source)
+
+        self.save_source = GLib.timeout_add_seconds(save_delay, self.save_documents)
+
+    def save_documents(self):
+        """save the state of all open documents, see Service.save."""
+        self.save_source = 0
+
+        for app in self.apps.values():
+            for doc in app.docs.values():
+                self.pool.submit([doc], lambda app=app, doc=doc: app.service.save(doc),
+                                 lambda *args: None, priority=worker.PRIORITY_LOW)
+
+        return False
+
+    def dispose_document(self, app, doc):
+        self.recent.pop(doc, None)
+        doc.cancellable.cancel()
+
+        # Dispose of the service state after any pending parse of the document
+        self.pool.submit([doc], lambda: app.service.dispose(doc), lambda *args: None)
+        self.unexport_document(doc)
+
+    def dispose_app(self, app):
+        for doc in app.docs:
+            self.dispose_document(app, app.docs[doc])
+
+        del self.apps[app.name]
+
+        if len(self.apps) == 0:
+            self.idle()
+
+    def idle(self):
+        """called when the last client app has gone.
+
+        Exits once the server has been idle for linger seconds, keeping
+        imported modules, the shared service and the caches warm for a client
+        which comes back in the meantime.
+        """
+        if linger <= 0:
+            GLib.idle_add(self.exit)
+            return
+
+        if trim_memory:
+            release_memory()
+
+        self.linger_source = GLib.timeout_add_seconds(linger, self.exit)
+
+    def exit(self):
+        """exit once the pending jobs (e.g. disposing documents) are done."""
+        queued, running = self.pool.stats()
+
+        if queued + running == 0:
+            sys.exit(0)
+
+        self.linger_source = GLib.timeout_add(50, self.exit)
+        return False
+
+# ex:ts=4:et:
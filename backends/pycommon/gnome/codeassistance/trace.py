@@ -0,0 +1,151 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""Tracing of the stages of a parse.
+
+When enabled (with --trace FILE), spans are recorded in the Chrome trace
+event format, which can be loaded in chrome://tracing or Perfetto. Only the
+most recent events are kept. The trace is written to FILE when the backend
+exits, or whenever it receives SIGUSR1.
+
+Backends can trace their own stages with:
+
+    with trace.span('pylint', path=doc.path):
+        ...
+"""
+
+import collections, threading, time, json, os, atexit, signal
+
+enabled = False
+
+# The file to write the trace to
+path = None
+
+# The maximum number of events kept
+size = 100000
+
+_events = collections.deque(maxlen=size)
+_threads = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+def now():
+    """get the current trace timestamp in microseconds."""
+    return time.perf_counter() * 1000000
+
+def complete(name, start, end=None, **args):
+    """record a span from start to end (see now()).
+
+    end defaults to now.
+    """
+    if not enabled:
+        return
+
+    if end is None:
+        end = now()
+
+    tid = threading.current_thread().ident
+
+    if not tid in _threads:
+        with _lock:
+            _threads[tid] = threading.current_thread().name
+
+    _events.append({
+        'name': name,
+        'ph': 'X',
+        'ts': start,
+        'dur': end - start,
+        'pid': _pid,
+        'tid': tid,
+        'args': args
+    })
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = now()
+        return self
+
+    def __exit__(self, typ, value, tb):
+        if not typ is None:
+            self.args['error'] = typ.__name__
+
+        complete(self.name, self.start, **self.args)
+        return False
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, typ, value, tb):
+        return False
+
+_null_span = NullSpan()
+
+def span(name, **args):
+    """trace a block of code as a span with the given name and arguments."""
+    if not enabled:
+        return _null_span
+
+    return Span(name, args)
+
+def events():
+    with _lock:
+        threads = dict(_threads)
+
+    ret = [{'name': 'thread_name', 'ph': 'M', 'pid': _pid, 'tid': tid, 'args': {'name': name}}
+           for tid, name in threads.items()]
+
+    return ret + list(_events)
+
+def write():
+    if path is None:
+        return
+
+    tmpname = path + '.tmp'
+
+    with open(tmpname, 'w') as f:
+        json.dump({'traceEvents': events(), 'displayTimeUnit': 'ms'}, f)
+
+    os.rename(tmpname, path)
+
+def enable(filename):
+    """start tracing to filename."""
+    global enabled, path, _events
+
+    path = filename
+    enabled = True
+
+    _events = collections.deque(maxlen=size)
+
+    atexit.register(write)
+
+    try:
+        from gi.repository import GLib
+
+        def on_signal():
+            write()
+            return True
+
+        GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGUSR1, on_signal)
+    except (ImportError, AttributeError):
+        pass
+
+# ex:ts=4:et:
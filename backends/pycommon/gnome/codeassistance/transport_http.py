@@ -0,0 +1,323 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+"""JSON over HTTP transport.
+
+The HTTP transport serves the same objects and methods as the D-Bus
+transport. A method is called by POSTing a JSON object to the object path
+followed by the method name, for example:
+
+    POST /org/gnome/CodeAssist/v1/python/Parse
+    {"app": "myeditor-1", "args": ["/a.py", "/tmp/a.py", [0, 0], {}]}
+
+The "app" member identifies the client and takes the role of the D-Bus
+sender. "args" contains the method arguments in the same order and layout
+as their D-Bus counterparts, with structs represented as arrays. The reply
+is a JSON object with either a "result" member, or an "error" and "message"
+member. Document object paths returned by Parse and ParseAll are used the
+same way to call the Diagnostics methods of a document. There are no
+signals, clients poll DiagnosticsSince instead of listening for Changed.
+
+Connections are kept alive (HTTP/1.1) and requests are handled
+concurrently, each on its own thread. Requests are dispatched on the main
+loop, so the server itself is no different from the D-Bus one.
+"""
+
+from gi.repository import GLib
+
+import http.server, socketserver
+import inspect, json, os, sys, threading
+
+from gnome.codeassistance import types, server, trace
+from gnome.codeassistance.server import Service, Project
+
+# The address to listen on, [host]:port. The host defaults to the loopback
+# interface and port 0 picks a free port
+address = ':0'
+
+class Method:
+    def __init__(self, interface, nargs, sender, asynchronous):
+        self.interface = interface
+        self.nargs = nargs
+        self.sender = sender
+        self.asynchronous = asynchronous
+
+def method(interface, nargs, sender=False, asynchronous=False):
+    """export a method over HTTP.
+
+    nargs is the number of arguments of the method. If sender is True, the
+    method receives the client app id as its first argument. Asynchronous
+    methods receive reply_cb and error_cb as their last two arguments instead
+    of returning their result.
+    """
+    def decorator(func):
+        func.http_method = Method(interface, nargs, sender, asynchronous)
+        return func
+
+    return decorator
+
+class Error(Exception):
+    def __init__(self, status, name, message):
+        super(Error, self).__init__(message)
+
+        self.status = status
+        self.name = name
+
+class Document(server.Document):
+    """Base Document interface.
+
+    Implementations should inherit from this base class which implements the
+    org.gnome.CodeAssist.v1.Document interface.
+    """
+
+    interface = 'org.gnome.CodeAssist.v1.Document'
+
+    def __init__(self):
+        super(Document, self).__init__()
+
+        self.object_path = ''
+
+class Diagnostics(server.Diagnostics):
+    """Diagnostics interface.
+
+    Implementations can inherit from this class to implement the
+    org.gnome.CodeAssist.v1.Diagnostics interface (see server.Diagnostics).
+    """
+
+    interface = 'org.gnome.CodeAssist.v1.Diagnostics'
+
+    @method(interface, 0)
+    def Diagnostics(self):
+        return self.serialized_diagnostics()
+
+    @method(interface, 1)
+    def DiagnosticsSince(self, generation):
+        return self.diagnostics_since(generation)
+
+class Call:
+    def __init__(self, path, name, app, args):
+        self.path = path
+        self.name = name
+        self.app = app
+        self.args = args
+
+        self.status = 200
+        self.reply = None
+
+        self.done = threading.Event()
+
+    def return_result(self, result):
+        self.reply = {'result': result}
+        self.done.set()
+
+    def return_error(self, status, name, message):
+        self.status = status
+        self.reply = {'error': name, 'message': message}
+        self.done.set()
+
+class Server(server.Server):
+    def __init__(self, path):
+        super(Server, self).__init__()
+
+        self.object_path = path
+        self.objects = {}
+
+    @method('org.gnome.CodeAssist.v1.Metrics', 0)
+    def Metrics(self):
+        return self.metrics_snapshot()
+
+    def export_document(self, app, doc):
+        doc.object_path = self.object_path + '/' + str(app.id) + '/documents/' + str(doc.id)
+        self.objects[doc.object_path] = doc
+
+    def unexport_document(self, doc):
+        self.objects.pop(doc.object_path, None)
+
+    def call(self, path, name, app, args):
+        """call a method from a request handler thread.
+
+        The call is dispatched on the main loop, this blocks until it has
+        been replied to.
+        """
+        c = Call(path, name, app, args)
+
+        GLib.idle_add(self.dispatch, c)
+        c.done.wait()
+
+        return c
+
+    def dispatch(self, c):
+        try:
+            self.invoke(c)
+        except Error as e:
+            c.return_error(e.status, e.name, str(e))
+        except Exception as e:
+            c.return_error(500, type(e).__name__, str(e))
+
+        return False
+
+    def invoke(self, c):
+        if c.path == self.object_path:
+            obj = self
+        else:
+            try:
+                obj = self.objects[c.path]
+            except KeyError:
+                raise Error(404, 'UnknownObject', 'no object at {0}'.format(c.path))
+
+        try:
+            func = getattr(obj, c.name)
+            m = func.http_method
+        except AttributeError:
+            raise Error(404, 'UnknownMethod', 'no method {0} at {1}'.format(c.name, c.path))
+
+        if not isinstance(c.args, list) or len(c.args) != m.nargs:
+            raise Error(400, 'InvalidArgs', '{0}.{1} takes {2} arguments'.format(m.interface, c.name, m.nargs))
+
+        args = list(c.args)
+
+        if m.sender:
+            args.insert(0, c.app)
+
+        if not m.asynchronous:
+            c.return_result(func(*args))
+            return
+
+        def error_cb(e):
+            c.return_error(500, type(e).__name__, str(e))
+
+        func(*(args + [c.return_result, error_cb]))
+
+class ServeService:
+    @method('org.gnome.CodeAssist.v1.Service', 4, sender=True, asynchronous=True)
+    def Parse(self, sender, path, data_path, cursor, options, reply_cb, error_cb):
+        self.parse(sender, path, data_path, cursor, options,
+                   lambda doc: reply_cb(doc.object_path), error_cb)
+
+    @method('org.gnome.CodeAssist.v1.Service', 2, sender=True, asynchronous=True)
+    def ParseMany(self, sender, documents, options, reply_cb, error_cb):
+        self.parse_many(sender, documents, options,
+                        lambda parsed: reply_cb([d.object_path for d in parsed]), error_cb)
+
+    @method('org.gnome.CodeAssist.v1.Service', 1, sender=True)
+    def Dispose(self, sender, path):
+        path = os.path.normpath(path)
+
+        try:
+            app = self.apps[sender]
+        except KeyError:
+            return None
+
+        self.dispose(app, path)
+        return None
+
+class ServeProject:
+    @method('org.gnome.CodeAssist.v1.Project', 4, sender=True, asynchronous=True)
+    def ParseAll(self, sender, path, documents, cursor, options, reply_cb, error_cb):
+        def reply(parsed):
+            reply_cb([types.RemoteDocument(d.client_path, d.object_path).to_tuple() for d in parsed])
+
+        self.parse_all(sender, path, documents, cursor, options, reply, error_cb)
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except (ValueError, UnicodeDecodeError):
+            self.send_json(400, {'error': 'InvalidArgs', 'message': 'request body is not valid JSON'})
+            return
+
+        if not isinstance(body, dict):
+            self.send_json(400, {'error': 'InvalidArgs', 'message': 'request body should be an object'})
+            return
+
+        path, sep, name = self.path.partition('?')[0].rpartition('/')
+
+        c = self.server.codeassistance.call(path, name, str(body.get('app', '')), body.get('args', []))
+        self.send_json(c.status, c.reply)
+
+    def send_json(self, status, obj):
+        with trace.span('encode'):
+            data = json.dumps(obj).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class Transport():
+    def __init__(self, service, document, srvtype=Server):
+        path = '/org/gnome/CodeAssist/v1/' + service.language
+        servercls = self.make_server_cls(service, srvtype)
+
+        host, sep, port = address.rpartition(':')
+
+        self.server = servercls(path)
+        self.service = service
+        self.document = document
+
+        self.httpd = HTTPServer((host or '127.0.0.1', int(port or 0)), RequestHandler)
+        self.httpd.codeassistance = self.server
+
+    def make_server_cls(self, service, srvtype):
+        types = {
+            Service: ServeService,
+            Project: ServeProject
+        }
+
+        bases = inspect.getmro(service)[1:]
+        sb = []
+
+        for b in bases:
+            try:
+                sb.append(types[b])
+            except KeyError:
+                pass
+
+        if not ServeService in sb:
+            raise ValueError("service should at least inherit from transport.Service")
+
+        sb.append(srvtype)
+
+        return type('TheServerType', tuple(sb), {})
+
+    def run(self):
+        t = threading.Thread(target=self.httpd.serve_forever)
+        t.daemon = True
+        t.start()
+
+        # Let the client know where to connect to
+        host, port = self.httpd.server_address[:2]
+
+        sys.stdout.write('http://{0}:{1}{2}\n'.format(host, port, self.server.object_path))
+        sys.stdout.flush()
+
+        self.server.run(self.service, self.document)
+
+# ex:ts=4:et:
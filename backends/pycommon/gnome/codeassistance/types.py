@@ -15,7 +15,9 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-class OpenDocument:
+class OpenDocument(object):
+    __slots__ = ('path', 'data_path')
+
     def __init__(self, path='', data_path=''):
         self.path = path
         self.data_path = data_path
@@ -27,7 +29,9 @@ class OpenDocument:
     def __repr__(self):
         return '<OpenDocument: {0}, {1}>'.format(self.path, self.data_path)
 
-class RemoteDocument:
+class RemoteDocument(object):
+    __slots__ = ('path', 'remote_path')
+
     def __init__(self, path='', remote_path=''):
         self.path = path
         self.remote_path = remote_path
@@ -38,7 +42,9 @@ class RemoteDocument:
     def to_tuple(self):
         return (self.path, self.remote_path)
 
-class SourceLocation:
+class SourceLocation(object):
+    __slots__ = ('line', 'column')
+
     def __init__(self, line=0, column=0):
         self.line = line
         self.column = column
@@ -51,16 +57,22 @@ class SourceLocation:
         return cls(tp[0], tp[1])
 
     def to_range(self, file=0):
-        start = SourceLocation(line=self.line, column=self.column)
-        end = SourceLocation(line=self.line, column=self.column)
-        return SourceRange(file=file, start=start, end=end)
+        # The range gets its own location, shared as both its start and its
+        # end (as for any SourceRange without an explicit end)
+        return SourceRange(file=file, start=SourceLocation(self.line, self.column))
 
     def to_tuple(self):
         return (self.line, self.column)
 
-class SourceRange:
-    def __init__(self, file=0, start=SourceLocation(), end=None):
+class SourceRange(object):
+    __slots__ = ('file', 'start', 'end')
+
+    def __init__(self, file=0, start=None, end=None):
         self.file = file
+
+        if start is None:
+            start = SourceLocation()
+
         self.start = start
 
         if end is None:
@@ -71,24 +83,53 @@ class SourceRange:
     def __repr__(self):
         return '{0}-{1}'.format(self.start, self.end)
 
+    @classmethod
+    def from_tuple(cls, tp):
+        start = SourceLocation.from_tuple(tp[1])
+
+        if tp[2] == tp[1]:
+            end = start
+        else:
+            end = SourceLocation.from_tuple(tp[2])
+
+        return cls(file=tp[0], start=start, end=end)
+
     def to_range(self):
         return self
 
     def to_tuple(self):
-        return (self.file, self.start.to_tuple(), self.end.to_tuple())
+        start = self.start.to_tuple()
+
+        if self.end is self.start:
+            end = start
+        else:
+            end = self.end.to_tuple()
+
+        return (self.file, start, end)
+
+class Fixit(object):
+    __slots__ = ('location', 'replacement')
+
+    def __init__(self, location=None, replacement=''):
+        if location is None:
+            location = SourceRange()
 
-class Fixit:
-    def __init__(self, location=SourceRange(), replacement=''):
         self.location = location
         self.replacement = replacement
 
     def __repr__(self):
         return '<Fixit: {0}: {1}>'.format(self.location, self.replacement)
 
+    @classmethod
+    def from_tuple(cls, tp):
+        return cls(location=SourceRange.from_tuple(tp[0]), replacement=tp[1])
+
     def to_tuple(self):
         return (self.location.to_tuple(), self.replacement)
 
-class Diagnostic:
+class Diagnostic(object):
+    __slots__ = ('severity', 'fixits', 'locations', 'message')
+
     class Severity:
         NONE = 0
         INFO = 1
@@ -97,8 +138,15 @@ class Diagnostic:
         ERROR = 4
         FATAL = 5
 
-    def __init__(self, severity=Severity.NONE, fixits=[], locations=[], message=''):
+    def __init__(self, severity=Severity.NONE, fixits=None, locations=None, message=''):
         self.severity = severity
+
+        if fixits is None:
+            fixits = []
+
+        if locations is None:
+            locations = []
+
         self.fixits = fixits
         self.locations = locations
         self.message = message
@@ -106,6 +154,10 @@ class Diagnostic:
     def __repr__(self):
         return '<Diagnostic: {0}, {1}, {2}, {3}>'.format(self.severity, self.fixits, self.locations, self.message)
 
+    @classmethod
+    def from_tuple(cls, tp):
+        return cls(severity=tp[0], fixits=[Fixit.from_tuple(f) for f in tp[1]], locations=[SourceRange.from_tuple(l) for l in tp[2]], message=tp[3])
+
     def to_tuple(self):
         return (self.severity, [f.to_tuple() for f in self.fixits], [l.to_tuple() for l in self.locations], self.message)
 
@@ -0,0 +1,259 @@
+# gnome code assistance common
+# Copyright (C) 2013  Jesse van den Kieboom <jessevdk@gnome.org>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+from gi.repository import GLib
+
+import threading
+
+# Job priorities, lower values run first (as GLib priorities do)
+PRIORITY_HIGH = -100
+PRIORITY_DEFAULT = 0
+PRIORITY_LOW = 300
+
+class Cancelled(Exception):
+    pass
+
+class Cancellable:
+    """A thread safe cancellation token.
+
+    The API mirrors Gio.Cancellable. Callbacks connected with connect() are
+    invoked from the thread calling cancel(), or immediately if the token
+    was already cancelled.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._handlers = {}
+        self._nextid = 1
+
+    def cancel(self):
+        with self._lock:
+            if self._cancelled:
+                return
+
+            self._cancelled = True
+            handlers = list(self._handlers.values())
+
+        for handler in handlers:
+            handler()
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def raise_if_cancelled(self):
+        if self._cancelled:
+            raise Cancelled()
+
+    def connect(self, callback):
+        with self._lock:
+            if not self._cancelled:
+                handlerid = self._nextid
+                self._nextid += 1
+
+                self._handlers[handlerid] = callback
+                return handlerid
+
+        callback()
+        return 0
+
+    def disconnect(self, handlerid):
+        with self._lock:
+            try:
+                del self._handlers[handlerid]
+            except KeyError:
+                pass
+
+class Job:
+    def __init__(self, keys, func, callback, tag=None, cancellable=None, priority=PRIORITY_DEFAULT):
+        self.keys = frozenset(keys)
+        self.func = func
+        self.callbacks = [callback]
+        self.tag = tag
+        self.cancellable = cancellable
+        self.priority = priority
+
+        self.result = None
+        self.error = None
+
+class Pool:
+    """Run jobs on a set of worker threads.
+
+    Jobs are executed off the main loop and their callback is invoked on the
+    main loop once the job has finished. Jobs which share a key (usually a
+    document) never run concurrently and are run in the order in which they
+    were submitted. The keys of a job are only released after its callback
+    has run, so a callback always observes the state the job left behind.
+
+    Queued jobs are run in order of priority, and in the order in which they
+    were submitted for equal priorities. A job which has to wait for an
+    earlier job sharing one of its keys lends its priority to that job, so
+    that the earlier job does not hold it back.
+
+    Jobs can be tagged so that a newer job supersedes an older one with the
+    same tag. A superseded job which is still queued is dropped, and the
+    result of a superseded job which is already running is discarded. In
+    both cases the callbacks of the superseded job are called with the
+    result of the job that superseded it. The cancellable of a superseded
+    job is cancelled, so that it can stop doing work nobody is waiting for.
+    """
+
+    def __init__(self, size=1):
+        self.size = max(1, size)
+
+        self._cond = threading.Condition()
+        self._queue = []
+        self._busy = set()
+        self._threads = []
+        self._tagged = {}
+        self._running = 0
+
+    def submit(self, keys, func, callback, tag=None, cancellable=None, priority=PRIORITY_DEFAULT):
+        """submit a job to the pool.
+
+        func is called without arguments on a worker thread. When it returns
+        (or raises), callback is called on the main loop with the result and
+        the raised exception (or None). If tag is not None, the job
+        supersedes any queued or running job submitted with the same tag.
+        """
+        job = Job(keys, func, callback, tag, cancellable, priority)
+
+        with self._cond:
+            if not tag is None:
+                self._supersede(tag, job)
+
+            self._queue.append(job)
+
+            if len(self._threads) < self.size:
+                t = threading.Thread(target=self._run)
+                t.daemon = True
+
+                self._threads.append(t)
+                t.start()
+
+            self._cond.notify_all()
+
+        return job
+
+    def stats(self):
+        """get the number of queued and running jobs."""
+        with self._cond:
+            return (len(self._queue), self._running)
+
+    def _supersede(self, tag, job):
+        try:
+            prev = self._tagged[tag]
+        except KeyError:
+            prev = None
+
+        self._tagged[tag] = job
+
+        if prev is None:
+            return
+
+        job.callbacks = prev.callbacks + job.callbacks
+        prev.callbacks = []
+
+        if not prev.cancellable is None:
+            prev.cancellable.cancel()
+
+        try:
+            self._queue.remove(prev)
+        except ValueError:
+            # Already running, its callbacks are now empty so its result
+            # will simply be dropped when it finishes
+            pass
+
+    def _priorities(self):
+        # The effective priority of a queued job is the highest priority of
+        # the job itself and of any later job which shares one of its keys
+        ret = [0] * len(self._queue)
+        later = {}
+
+        for i in range(len(self._queue) - 1, -1, -1):
+            job = self._queue[i]
+            priority = job.priority
+
+            for key in job.keys:
+                if key in later:
+                    priority = min(priority, later[key])
+
+            for key in job.keys:
+                later[key] = priority
+
+            ret[i] = priority
+
+        return ret
+
+    def _next(self):
+        # Keys of jobs which are still waiting, so that later jobs sharing
+        # any of these keys do not overtake them
+        waiting = set()
+        priorities = self._priorities()
+        best = None
+
+        for i, job in enumerate(self._queue):
+            if job.keys.isdisjoint(self._busy) and job.keys.isdisjoint(waiting):
+                if best is None or priorities[i] < priorities[best]:
+                    best = i
+
+            waiting |= job.keys
+
+        if best is None:
+            return None
+
+        job = self._queue.pop(best)
+        self._busy |= job.keys
+
+        return job
+
+    def _run(self):
+        while True:
+            with self._cond:
+                job = self._next()
+
+                while job is None:
+                    self._cond.wait()
+                    job = self._next()
+
+                self._running += 1
+
+            try:
+                job.result = job.func()
+            except Exception as e:
+                job.error = e
+
+            with self._cond:
+                self._running -= 1
+
+            GLib.idle_add(self._finish, job)
+
+    def _finish(self, job):
+        try:
+            for callback in job.callbacks:
+                callback(job.result, job.error)
+        finally:
+            with self._cond:
+                if not job.tag is None and self._tagged.get(job.tag) is job:
+                    del self._tagged[job.tag]
+
+                self._busy -= job.keys
+                self._cond.notify_all()
+
+        return False
+
+# ex:ts=4:et:
@@ -18,7 +18,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
-import ast
+import ast, os
 
 try:
     import pycodestyle
@@ -47,7 +47,23 @@ try:
 except ImportError:
     HAS_PYFLAKES = False
 
-from gnome.codeassistance import transport, types
+from gnome.codeassistance import transport, types, trace
+
+def tools_version():
+    versions = []
+
+    if HAS_PYCODESTYLE:
+        versions.append('pycodestyle ' + getattr(pycodestyle, '__version__', ''))
+
+    if HAS_PYLINT:
+        import pylint
+        versions.append('pylint ' + getattr(pylint, '__version__', ''))
+
+    if HAS_PYFLAKES:
+        import pyflakes
+        versions.append('pyflakes ' + getattr(pyflakes, '__version__', ''))
+
+    return ', '.join(versions)
 
 class PyLint(object):
     def __init__(self, data_path):
@@ -164,13 +180,43 @@ class PyCodeStyle(object):
 
 class Service(transport.Service):
     language = 'python'
+    version = tools_version()
+
+    # Configuration files read by pycodestyle. Diagnostics are not cached when
+    # running pylint, so its configuration files do not matter.
+    config_names = ['setup.cfg', 'tox.ini', '.pycodestyle']
+
+    def config_files(self, doc):
+        ret = []
+        parent = os.path.dirname(os.path.abspath(doc.path))
+
+        while True:
+            ret.extend([os.path.join(parent, n) for n in self.config_names])
+
+            nparent = os.path.dirname(parent)
+
+            if nparent == parent:
+                break
+
+            parent = nparent
+
+        ret.append(os.path.expanduser('~/.config/pycodestyle'))
+
+        return ret
+
+    def use_pylint(self, options):
+        return HAS_PYLINT and "pylint" in options and options["pylint"]
+
+    def cacheable_with(self, options):
+        # pylint also reports on the modules imported by a document (e.g.
+        # no-member and import errors), which are not part of the cache key
+        return not self.use_pylint(options)
 
     def parse(self, doc, options):
         doc.diagnostics = []
-        use_pylint = HAS_PYLINT and "pylint" in options and options["pylint"]
+        use_pylint = self.use_pylint(options)
 
-        with open(doc.data_path) as f:
-            source = f.read()
+        source = doc.read().decode('utf-8')
 
         if not use_pylint and not HAS_PYFLAKES:
             # both pylint and pyflakes warn about syntax errors, so only need
@@ -183,24 +229,36 @@ class Service(transport.Service):
 
                 doc.diagnostics.append(types.Diagnostic(severity=severity, locations=[loc.to_range()], message=e.msg))
 
+        # Checkers are run from fast to slow, the diagnostics found so far are
+        # published before running pylint
+
         # Pycodestyle / PEP8 checks
         if HAS_PYCODESTYLE or True:
-            pycodestyle_checker = PyCodeStyle(source, doc.path)
-            for diagnostic in pycodestyle_checker.run():
-                doc.diagnostics.append(diagnostic)
+            with trace.span('pycodestyle', path=doc.path):
+                pycodestyle_checker = PyCodeStyle(source, doc.path)
+                for diagnostic in pycodestyle_checker.run():
+                    doc.diagnostics.append(diagnostic)
 
-        # Pylint checks (if present and enabled)
-        if use_pylint:
-            pylint = PyLint(doc.data_path)
-            diagnostics = pylint.run()
+        # Pyflakes check (if present)
+        if HAS_PYFLAKES:
+            doc.cancellable.raise_if_cancelled()
+
+            with trace.span('pyflakes', path=doc.path):
+                pyflakes = Pyflakes(doc.data_path)
+                diagnostics = pyflakes.run()
 
             for diag in diagnostics:
                 doc.diagnostics.append(diag)
 
-        # Pyflakes check (if present)
-        if HAS_PYFLAKES:
-            pyflakes = Pyflakes(doc.data_path)
-            diagnostics = pyflakes.run()
+        # Pylint checks (if present and enabled)
+        if use_pylint:
+            doc.publish_partial()
+            doc.cancellable.raise_if_cancelled()
+
+            with trace.span('pylint', path=doc.path):
+                pylint = PyLint(doc.data_path)
+                diagnostics = pylint.run()
+
             for diag in diagnostics:
                 doc.diagnostics.append(diag)
 
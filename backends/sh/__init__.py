@@ -38,6 +38,8 @@ class Service(transport.Service):
         try:
             p = subprocess.Popen(['shellcheck', '-f', 'gcc', doc.data_path],
                                  stdout=subprocess.PIPE)
+            handler = doc.cancellable.connect(p.kill)
+
             for line in iter(p.stdout.readline, ''):
                 if not line:
                     break
@@ -53,11 +55,15 @@ class Service(transport.Service):
                 doc.diagnostics.append(types.Diagnostic(severity=severity,
                                                         locations=[loc.to_range()],
                                                         message=result[3]))
+
+            doc.cancellable.disconnect(handler)
+            p.wait()
         except FileNotFoundError:
             # shellcheck is not installed. Check with bash dry run mode instead.
             try:
                 p = subprocess.Popen(["/bin/bash", "-n", doc.data_path],
                                      stdout=DEVNULL, stderr=subprocess.PIPE)
+                handler = doc.cancellable.connect(p.kill)
 
                 for l in iter(p.stderr.readline, ''):
                     if not l:
@@ -70,9 +76,14 @@ class Service(transport.Service):
                         doc.diagnostics.append(types.Diagnostic(severity=types.Diagnostic.Severity.ERROR,
                                                                 locations=[loc.to_range()],
                                                                 message=m.group(2)))
+
+                doc.cancellable.disconnect(handler)
+                p.wait()
             except Exception as e:
                 pass
 
+        doc.cancellable.raise_if_cancelled()
+
     def dispose(self, doc):
         pass
 
@@ -17,12 +17,37 @@
 # Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
 
 from lxml import etree
-import os
+import os, re
 
 from gnome.codeassistance import transport, types
 
 class Service(transport.Service):
     language = 'xml'
+    version = 'lxml {0}, libxml2 {1}'.format(etree.LXML_VERSION, etree.LIBXML_VERSION)
+
+    # Parsing keeps no state (lxml error logs are per thread) and lxml
+    # releases the GIL while parsing, documents can be parsed concurrently
+    workers = 4
+
+    schema_pattern = re.compile(r'<!--\s*schema\s*:\s*(.*?)\s*-->', re.I | re.S)
+
+    def config_files(self, doc):
+        """ Schemas referenced by the document affect its diagnostics """
+
+        if not os.path.isabs(doc.path):
+            return []
+
+        source = doc.read().decode('utf-8')
+
+        ret = []
+
+        for location in Service.schema_pattern.findall(source):
+            if not os.path.isabs(location):
+                location = os.path.join(os.path.dirname(doc.path), location)
+
+            ret.append(location)
+
+        return ret
 
     def get_schema(self, path, location, schema_text=None):
         schema_type = None
@@ -108,8 +133,7 @@ class Service(transport.Service):
         doc_type = 'XML'
         etree.clear_error_log()
 
-        with open(doc.data_path) as f:
-            source = f.read()
+        source = doc.read().decode('utf-8')
 
         try:
             # parse the XML for errors
@@ -23,16 +23,15 @@ from gnome.codeassistance import transport, types
 from yamllint.config import YamlLintConfig
 from yamllint.linter import PROBLEM_LEVELS
 from yamllint import linter
+import yamllint
 
 
-def get_yamllint_config(doc_path):
-    """ Look for yamllint config files and return a YamlLintConfig object """
+def get_yamllint_config_files(doc_path):
+    """ List the yamllint config files for a document, in order of preference """
 
     # try .yamlllint first
     doc_dir = os.path.dirname(doc_path)
     dotfile = os.path.join(doc_dir, '.yamllint')
-    if os.path.isfile(dotfile):
-        return YamlLintConfig(file=dotfile)
 
     # try the global user config file second
 
@@ -41,8 +40,15 @@ def get_yamllint_config(doc_path):
     else:
         configfile = os.path.expanduser('~/.config/yamllint/config')
 
-    if os.path.isfile(configfile):
-        return YamlLintConfig(file=configfile)
+    return [dotfile, configfile]
+
+
+def get_yamllint_config(doc_path):
+    """ Look for yamllint config files and return a YamlLintConfig object """
+
+    for configfile in get_yamllint_config_files(doc_path):
+        if os.path.isfile(configfile):
+            return YamlLintConfig(file=configfile)
 
     # use default config if no config file exists
     return YamlLintConfig('extends: default')
@@ -50,6 +56,13 @@ def get_yamllint_config(doc_path):
 
 class Service(transport.Service):
     language = 'yaml'
+    version = yamllint.APP_VERSION
+
+    # Parsing keeps no state, documents can be parsed concurrently
+    workers = 4
+
+    def config_files(self, doc):
+        return get_yamllint_config_files(doc.path)
 
     def parse(self, doc, options):
         doc.diagnostics = []
@@ -57,19 +70,20 @@ class Service(transport.Service):
         # load the yamllint config file, if exists
         config = get_yamllint_config(doc.path)
 
-        with open(doc.data_path) as f:
-            for problem in linter.run(f, config, doc.data_path):
-                loc = types.SourceLocation(line=problem.line, column=problem.column)
+        source = doc.read().decode('utf-8')
+
+        for problem in linter.run(source, config, doc.data_path):
+            loc = types.SourceLocation(line=problem.line, column=problem.column)
 
-                severity = types.Diagnostic.Severity.INFO
-                if problem.level == 'warning':
-                    severity = types.Diagnostic.Severity.WARNING
-                elif problem.level == 'error':
-                    severity = types.Diagnostic.Severity.ERROR
+            severity = types.Diagnostic.Severity.INFO
+            if problem.level == 'warning':
+                severity = types.Diagnostic.Severity.WARNING
+            elif problem.level == 'error':
+                severity = types.Diagnostic.Severity.ERROR
 
-                doc.diagnostics.append(types.Diagnostic(severity=severity,
-                                                        locations=[loc.to_range()],
-                                                        message=problem.message))
+            doc.diagnostics.append(types.Diagnostic(severity=severity,
+                                                    locations=[loc.to_range()],
+                                                    message=problem.message))
 
 
 class Document(transport.Document, transport.Diagnostics):